@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+'''
+Node count and time for numbering the lines of large listings, the way
+directives used to (highlight_as's nodes, then add_line_numbers splitting
+them up) against the way they do now (number_lines over the tokens, then one
+node per token). The last column is the same listing written straight to
+HTML, as directives do for the HTML writers (see rawhtml), which makes no
+nodes at all.
+
+    python benchmarks/line_numbers.py [LINES ...]
+
+Lexing is done once beforehand and left out of the times.
+'''
+
+import gc
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from docutils import nodes
+from rstweaver.highlight import TokenCache, highlight_as, highlight_tokens, \
+    token_nodes, number_lines
+from rstweaver.rawhtml import tokens_html
+
+def old_add_line_numbers(toks, start):
+    # directives.add_line_numbers as it was.
+    def ln(n):
+        return nodes.inline('', '%3d  ' % n, classes=['lineno'])
+
+    def gen():
+        yield ln(start)
+        line = start + 1
+        for j in range(len(toks)):
+            node = toks[j]
+
+            text = node.rawsource
+            parts = text.split('\n')
+
+            if len(parts) == 1:
+                yield node
+            else:
+                classes = node.attributes['classes']
+
+                for k in range(len(parts)):
+                    yield nodes.inline('', parts[k], classes=classes)
+                    if k < len(parts)-1:
+                        yield nodes.inline('\n', '\n')
+                        if k < len(parts)-2 or j < len(toks)-1:
+                            yield ln(line)
+                        line += 1
+
+    return list(gen())
+
+def old(code, cache):
+    return old_add_line_numbers(highlight_as(code, 'python', cache), 1)
+
+def new(code, cache):
+    return token_nodes(list(number_lines(highlight_tokens(code, 'python', cache), 1)))
+
+def html(code, cache):
+    return tokens_html(list(number_lines(highlight_tokens(code, 'python', cache), 1)))
+
+def listing(lines):
+    '''
+    Python source of about `lines` lines, a good part of it in docstrings
+    and comments (tokens running over several lines).
+    '''
+    chunk = [
+        'def f%d(x):',
+        '    """',
+        '    Frobnicate x.',
+        '    ',
+        '    Returns:',
+        '        x, frobnicated.',
+        '    """',
+        '    # Nothing to it.',
+        '    return x + %d',
+        ''
+    ]
+    out = [ ]
+    k = 0
+    while len(out) < lines:
+        out += [line.replace('%d', str(k)) for line in chunk]
+        k += 1
+    return '\n'.join(out[:lines]) + '\n'
+
+def best(f, repeat=5):
+    # As timeit does, with the collector off so that it doesn't land on
+    # whichever happens to be running.
+    times = [ ]
+    for k in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.time()
+            result = f()
+            times.append(time.time() - start)
+        finally:
+            gc.enable()
+    return min(times), result
+
+def main(sizes):
+    print('%8s  %12s %10s  %12s %10s  %10s' % (
+        'lines', 'old nodes', 'old ms', 'new nodes', 'new ms', 'html ms'))
+
+    for size in sizes:
+        code = listing(size)
+        cache = TokenCache()
+        highlight_tokens(code, 'python', cache)
+
+        old_time, old_nodes = best(lambda: old(code, cache))
+        new_time, new_nodes = best(lambda: new(code, cache))
+        html_time, _ = best(lambda: html(code, cache))
+
+        print('%8d  %12d %10.1f  %12d %10.1f  %10.1f' % (
+            size,
+            len(old_nodes), old_time * 1000,
+            len(new_nodes), new_time * 1000,
+            html_time * 1000
+        ))
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [500, 2000, 10000])
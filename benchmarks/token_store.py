@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+'''
+Time for highlighting many short pieces of code (interactive lines, say)
+by lexing them, against looking them up in a TokenStore filled by an
+earlier build, which is what a build of an unchanged document does. The
+last column is the earlier build itself: lexing, then writing the store.
+
+    python benchmarks/token_store.py [PIECES ...]
+
+Each build gets a fresh TokenCache, so nothing is found in memory.
+'''
+
+import gc
+import os
+import sys
+import time
+import shutil
+from tempfile import mkdtemp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from rstweaver.highlight import TokenCache, TokenStore, highlight_tokens
+
+def pieces(count):
+    return ['x%d = f(%d) + [y for y in range(%d)]' % (k, k, k)
+        for k in range(count)]
+
+def build(codes, store=None):
+    cache = TokenCache(store)
+    for code in codes:
+        highlight_tokens(code, 'python', cache)
+    if store != None:
+        store.close()
+
+def timed(f):
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.time()
+        f()
+        return time.time() - start
+    finally:
+        gc.enable()
+
+def best(f, repeat=5):
+    return min(timed(f) for k in range(repeat))
+
+def main(sizes):
+    print('%8s  %10s %10s %10s' % ('pieces', 'lex ms', 'hit ms', 'cold ms'))
+
+    # Make the lexer beforehand, so that no column pays for it.
+    highlight_tokens('x', 'python', TokenCache())
+
+    for size in sizes:
+        codes = pieces(size)
+        dir = mkdtemp()
+        try:
+            path = os.path.join(dir, 'highlight.sqlite')
+
+            cold_time = timed(lambda: build(codes, TokenStore(path)))
+            lex_time  = best(lambda: build(codes))
+            hit_time  = best(lambda: build(codes, TokenStore(path)))
+        finally:
+            shutil.rmtree(dir, True)
+
+        print('%8d  %10.1f %10.1f %10.1f' % (
+            size, lex_time * 1000, hit_time * 1000, cold_time * 1000))
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [100, 500, 2000])
@@ -0,0 +1,271 @@
+
+'''
+A cache of compiler output, in the manner of ccache.
+
+An object file is kept under a key made from the preprocessed source, the
+compiler's version and the flags, so a file is only really compiled when
+something that could change the result has changed, whichever directive,
+document or weaver dir it comes from. A program is kept under the keys of
+the objects linked into it, and a precompiled header under its preprocessed
+text. Haskell programs are left to ghc --make, in a directory for each
+main module's source (see make_haskell).
+
+Everything lives in the user cache dir (see utils.user_cache_dir), so it
+survives the weaver dir's own cache being cleared or evicted; it can itself
+be deleted at any time. At the end of a build that used it, the least
+recently used entries are deleted until it is within
+utils.user_cache_budget().
+
+Preprocessing reads every header the source includes, so the run that asks
+for a build still sees (and depends on) them even when nothing is compiled.
+
+Every process is read with the communicate it is given (a WeaverLanguage's),
+so compilers are held to the run's timeout and their messages to its output
+limit like anything else the run starts.
+'''
+
+import os
+import atexit
+from collections import namedtuple
+from tempfile import mkstemp
+from subprocess import Popen, PIPE, STDOUT
+from utils import user_cache_dir, user_cache_budget, locked, fingerprint, \
+    used, trim_cache
+
+# status is the compiler's exit status, messages what it said, path where the
+# product is (None if it failed), and key what the product is cached under.
+Built = namedtuple('Built', ['status', 'messages', 'path', 'key'])
+
+versions = { }
+
+def compiler_version(compiler, communicate):
+    '''
+    What compiler --version says, asked once per compiler (that answers).
+    '''
+    if compiler not in versions:
+        # Not started with popen: only the first run to ask would see it.
+        proc = Popen(
+            [compiler, '--version'],
+            stdout = PIPE,
+            stderr = STDOUT,
+            preexec_fn = os.setsid
+        )
+        out, err = communicate(proc)
+        if proc.returncode != 0:
+            return out
+        versions[compiler] = out
+    return versions[compiler]
+
+def compile_object(popen, communicate, compiler, flags, source, wd):
+    '''
+    Compile source (relative to wd) to an object file, or find it already
+    compiled.
+    
+    Parameters:
+        popen       -- How to start processes (a WeaverLanguage's popen).
+        communicate -- How to read them (a WeaverLanguage's communicate).
+    
+    Returns:
+        Built.
+    '''
+    pre = popen(
+        [compiler, '-E'] + flags + [source],
+        stdout = PIPE,
+        stderr = PIPE,
+        cwd = wd
+    )
+    # All of the text, since it is what the object is filed under.
+    text, err = communicate(pre, None, 0)
+    if pre.returncode != 0:
+        return Built(pre.returncode, err, None, None)
+    
+    key = fingerprint(('object', compiler_version(compiler, communicate),
+        flags, text))
+    return cached(popen, communicate, key, '.o',
+        lambda out: [compiler] + flags + ['-c', '-o', out, source], wd)
+
+def link_program(popen, communicate, compiler, flags, objects, wd):
+    '''
+    Link objects (Builts from compile_object) into a program, or find it
+    already linked.
+    '''
+    key = fingerprint(('program', compiler_version(compiler, communicate),
+        flags, [obj.key for obj in objects]))
+    return cached(popen, communicate, key, '',
+        lambda out: [compiler] + flags + ['-o', out] + [obj.path for obj in objects],
+        wd)
+
+def build_program(popen, communicate, compiler, flags, sources, wd):
+    '''
+    Compile each of sources and link them into a program.
+    
+    Returns:
+        Built, with the messages from every step.
+    '''
+    objects  = [ ]
+    messages = ''
+    for source in sources:
+        obj = compile_object(popen, communicate, compiler, flags, source, wd)
+        messages += obj.messages
+        if obj.status != 0:
+            return Built(obj.status, messages, None, None)
+        objects.append(obj)
+    
+    program = link_program(popen, communicate, compiler, flags, objects, wd)
+    return program._replace(messages = messages + program.messages)
+
+def source_file(text, suffix):
+    '''
+    A file holding text, for sources made up on the spot (icpp's main()),
+    kept here rather than in wd so that no file there is overwritten. The
+    same text always gets the same name, since preprocessed text (and so
+    the object's key) mentions it.
+    '''
+    key = fingerprint(('source', text))
+    entry_dir = user_cache_dir('build', key[:2])
+    path = os.path.join(entry_dir, key + suffix)
+    if not os.path.exists(path):
+        fd, temp = mkstemp(dir=entry_dir)
+        with os.fdopen(fd, 'w') as hl:
+            hl.write(text)
+        os.chmod(temp, 0o644)
+        os.rename(temp, path)
+    used(path)
+    touched[0] = True
+    return path
+
+def precompile_header(popen, communicate, compiler, flags, includes, wd):
+    '''
+    Precompile a header that #includes each of includes (quoted names, as
+    from a source file in wd), or find it already precompiled.
+    
+    Returns:
+        Built, whose path is the header to pass to -include (the precompiled
+        one sits next to it). Sources using it must be compiled with the same
+        flags.
+    '''
+    header = ''.join('#include "%s"\n' % name for name in includes)
+    
+    pre = popen(
+        [compiler, '-x', 'c++-header', '-E'] + flags + ['-'],
+        stdin  = PIPE,
+        stdout = PIPE,
+        stderr = PIPE,
+        cwd = wd
+    )
+    text, err = communicate(pre, header, 0)
+    if pre.returncode != 0:
+        return Built(pre.returncode, err, None, None)
+    
+    key = fingerprint(('header', compiler_version(compiler, communicate),
+        flags, text))
+    entry_dir = user_cache_dir('build', key[:2])
+    path = os.path.join(entry_dir, key + '.h')
+    if not os.path.exists(path):
+        fd, temp = mkstemp(dir=entry_dir)
+        with os.fdopen(fd, 'w') as hl:
+            hl.write(header)
+        os.chmod(temp, 0o644)
+        os.rename(temp, path)
+    used(path)
+    
+    built = cached(popen, communicate, key, '.h.gch',
+        lambda out: [compiler, '-x', 'c++-header'] + flags + ['-o', out, path], wd)
+    
+    if built.status != 0:
+        return built
+    return built._replace(path = path)
+
+def make_haskell(popen, communicate, flags, source, wd, scope, link=True):
+    '''
+    Build source (relative to wd) and the local modules it imports with
+    ghc --make, or find it already built.
+    
+    The .hi and .o files and the program go in a directory of their own for
+    each content of source (and scope), so nothing is left in wd. ghc itself
+    decides which of the local modules need compiling again, by looking at
+    them, so this is still asked for on every run. Since it goes by their
+    names, scope should tell apart places where the same name could mean
+    different modules (a weaver dir, say).
+    
+    Parameters:
+        link -- Whether to make a program; otherwise only compile.
+    
+    Returns:
+        Built, whose path is the program (if linked).
+    '''
+    with open(os.path.join(wd, source), 'rb') as hl:
+        text = hl.read()
+    
+    key = fingerprint(('haskell', compiler_version('ghc', communicate), flags,
+        scope, text))
+    build_dir = user_cache_dir('ghc', key[:2], key)
+    used(build_dir)
+    touched[0] = True
+    program = os.path.join(build_dir, 'program')
+    
+    command = ['ghc', '--make', '-v0', '-outputdir', build_dir] + flags
+    if link:
+        command += ['-o', program]
+    else:
+        command += ['-no-link']
+    
+    with locked(os.path.join(build_dir, 'lock')):
+        proc = popen(
+            command + [source],
+            stdout = PIPE,
+            stderr = STDOUT,
+            cwd = wd
+        )
+        messages, err = communicate(proc)
+    
+    if proc.returncode != 0:
+        return Built(proc.returncode, messages, None, key)
+    return Built(0, messages, program if link else None, key)
+
+def cached(popen, communicate, key, suffix, command, wd):
+    '''
+    The product cached under key, making it with command(output path) if
+    it isn't there. Failures aren't kept.
+    '''
+    entry_dir = user_cache_dir('build', key[:2])
+    path = os.path.join(entry_dir, key + suffix)
+    log  = os.path.join(entry_dir, key + '.log')
+    
+    with locked(os.path.join(entry_dir, key + '.lock')):
+        touched[0] = True
+        if os.path.exists(path) and os.path.exists(log):
+            used(path)
+            used(log)
+            with open(log, 'rb') as hl:
+                return Built(0, hl.read(), path, key)
+        
+        temp = path + '.tmp'
+        proc = popen(
+            command(temp),
+            stdout = PIPE,
+            stderr = STDOUT,
+            cwd = wd
+        )
+        messages, err = communicate(proc)
+        
+        if proc.returncode != 0:
+            if os.path.exists(temp):
+                os.remove(temp)
+            return Built(proc.returncode, messages, None, key)
+        
+        with open(log, 'wb') as hl:
+            hl.write(messages)
+        os.rename(temp, path)
+    
+    return Built(0, messages, path, key)
+
+# Whether anything was built or reused here, so worth trimming at exit.
+touched = [False]
+
+def trim():
+    if touched[0]:
+        trim_cache([user_cache_dir('build'), user_cache_dir('ghc')],
+            user_cache_budget())
+
+atexit.register(trim)
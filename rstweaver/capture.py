@@ -0,0 +1,143 @@
+
+'''
+Reading a program's output without keeping all of it.
+
+A runaway example can print far more than anyone will read (or than there is
+memory for). Output is read as it comes; only the first and last limit/2
+bytes of each stream are kept, and if there turns out to be more than that,
+the whole stream goes to a file in the spill directory and the text returned
+says where it went. A limit of 0 keeps everything.
+
+Spill files are named after their contents, and the text names them relative
+to the spill directory's parent (the weaver dir), so it comes out the same
+wherever that is and can be cached and shared.
+'''
+
+import os
+import hashlib
+import threading
+from tempfile import mkstemp
+from utils import makepdir
+
+# Bytes of each stream to keep (half from the start, half from the end).
+default_output_limit = 64 * 1024
+
+chunk_size = 65536
+
+class Capture(object):
+    
+    def __init__(self, limit, spill_dir):
+        self.limit     = limit
+        self.head_size = limit // 2
+        self.tail_size = limit - self.head_size
+        self.spill_dir = spill_dir
+        
+        self.chunks = [ ]
+        self.total  = 0
+        self.hash   = hashlib.sha1()
+        
+        self.spill = None
+        self.head  = ''
+        self.tail  = ''
+    
+    def feed(self, data):
+        self.total += len(data)
+        self.hash.update(data)
+        
+        if self.spill != None:
+            self.spill.write(data)
+            self.tail = (self.tail + data)[-self.tail_size:]
+            return
+        
+        self.chunks.append(data)
+        if self.limit and self.total > self.limit:
+            text = ''.join(self.chunks)
+            self.chunks = [ ]
+            
+            makepdir(self.spill_dir)
+            fd, self.spill_path = mkstemp(dir=self.spill_dir)
+            self.spill = os.fdopen(fd, 'wb')
+            self.spill.write(text)
+            
+            self.head = text[:self.head_size]
+            self.tail = text[-self.tail_size:]
+    
+    def text(self):
+        '''
+        Everything fed, or if that was too much, the start and end of it
+        with a note in between.
+        '''
+        if self.spill == None:
+            return ''.join(self.chunks)
+        
+        name = self.hash.hexdigest() + '.out'
+        if not self.spill.closed:
+            self.spill.close()
+            path = os.path.join(self.spill_dir, name)
+            os.rename(self.spill_path, path)
+            self.spill_path = path
+        
+        omitted = self.total - len(self.head) - len(self.tail)
+        return (
+              self.head
+            + '\n\n[... %d bytes omitted; all %d bytes are in %s ...]\n\n' % (
+                omitted, self.total,
+                os.path.join(os.path.basename(self.spill_dir), name))
+            + self.tail
+        )
+    
+    def overflowed(self):
+        return self.spill != None
+
+def communicate(proc, input=None, limit=default_output_limit, spill_dir='.',
+        sink=None):
+    '''
+    Like proc.communicate(input), but keeping at most about limit bytes of
+    each of stdout and stderr (see Capture).
+    
+    If sink is given, stdout is passed to sink.feed() as it comes instead,
+    and None returned for it.
+    '''
+    threads = [ ]
+    captures = [ ]
+    
+    if proc.stdin != None:
+        threads.append(threading.Thread(target=write_all, args=(proc.stdin, input)))
+    
+    for stream, sink in ((proc.stdout, sink), (proc.stderr, None)):
+        if stream == None:
+            captures.append(None)
+        elif sink != None:
+            captures.append(None)
+            threads.append(threading.Thread(target=read_all, args=(stream, sink)))
+        else:
+            capture = Capture(limit, spill_dir)
+            captures.append(capture)
+            threads.append(threading.Thread(target=read_all, args=(stream, capture)))
+    
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    proc.wait()
+    
+    return tuple(None if c == None else c.text() for c in captures)
+
+def write_all(stream, input):
+    try:
+        if input:
+            stream.write(input)
+        stream.close()
+    except IOError:
+        pass
+
+def read_all(stream, capture):
+    fd = stream.fileno()
+    while True:
+        data = os.read(fd, chunk_size)
+        if data == '':
+            break
+        capture.feed(data)
+    stream.close()
+
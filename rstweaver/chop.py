@@ -0,0 +1,122 @@
+
+'''
+Splitting an interactive session's output up by line of input.
+
+Sessions are run with a uuid printed before the first line and after each
+line (see WeaverLanguage.chopped_interactive), and the output between two
+of them belongs to the line in between. A Chopper takes output as it comes
+and hands out the pieces in a single pass, so a long session costs no more
+than reading it.
+
+If a delimiter never comes out (a line ate it, or the interpreter died) only
+the lines around it suffer: output goes to the line after the last delimiter
+seen, and lines whose delimiters are missing get nothing. If none come out
+at all, everything is in unchopped().
+
+Each line's output is kept in a capture.Capture, so a line that prints too
+much is cut down like any other program's output.
+'''
+
+import re
+from capture import Capture
+
+class Chopper(object):
+    
+    def __init__(self, ids, get_id, limit=0, spill_dir=None):
+        '''
+        Parameters:
+            ids    -- The delimiters, as passed to put_id: ids[0] comes before
+              the first line's output, ids[k+1] after line k's.
+            get_id -- How an id looks in the output. The id has to appear
+              in it whole.
+            limit, spill_dir -- For each line's Capture; by default
+              everything is kept.
+        '''
+        prefix, suffix = get_id('\0').split('\0')
+        self.pattern = re.compile(
+            re.escape(prefix) + '([0-9a-f]{%d})' % len(ids[0]) + re.escape(suffix))
+        self.span = len(prefix) + len(ids[0]) + len(suffix)
+        
+        self.index = dict((id, k) for k, id in enumerate(ids))
+        self.outputs = [Capture(limit, spill_dir) for k in range(len(ids)-1)]
+        self.before  = Capture(limit, spill_dir)
+        
+        # Index of the last delimiter seen, so the line output is going to.
+        self.current = None
+        self.pending = ''
+        self.finished = False
+    
+    def feed(self, data):
+        '''
+        Take some more output.
+        '''
+        text = self.pending + data
+        start = 0
+        pos   = 0
+        
+        while not self.finished:
+            match = self.pattern.search(text, pos)
+            if match == None:
+                break
+            
+            k = self.index.get(match.group(1))
+            if k == None or (self.current != None and k <= self.current):
+                # Hex that happens to look like one, or a delimiter out of
+                # order (echoed input, say).
+                pos = match.start() + 1
+                continue
+            
+            self.put(text[start:match.start()])
+            self.current = k
+            self.finished = k == len(self.outputs)
+            start = pos = match.end()
+        
+        if self.finished:
+            self.pending = ''
+            return
+        
+        # The end might be the start of a delimiter that isn't all here yet.
+        keep = max(start, len(text) - self.span + 1)
+        self.put(text[start:keep])
+        self.pending = text[keep:]
+    
+    def put(self, text):
+        if not text:
+            return
+        if self.current == None:
+            self.before.feed(text)
+        elif self.current < len(self.outputs):
+            self.outputs[self.current].feed(text)
+    
+    def overflowed(self):
+        '''
+        Whether some line has printed more than the limit.
+        '''
+        return (self.before.overflowed()
+            or any(output.overflowed() for output in self.outputs))
+    
+    def lines(self):
+        '''
+        The output of each line, after all the output has been fed.
+        '''
+        self.put(self.pending)
+        self.pending = ''
+        return [output.text() for output in self.outputs]
+    
+    def unchopped(self):
+        '''
+        The output before the first delimiter, after all the output has been
+        fed: all of it, if current is still None.
+        '''
+        self.put(self.pending)
+        self.pending = ''
+        return self.before.text()
+
+def chop(ids, get_id, output):
+    '''
+    Split all of output at once; see Chopper.
+    '''
+    chopper = Chopper(ids, get_id)
+    chopper.feed(output)
+    return chopper.lines()
+
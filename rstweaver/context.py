@@ -10,24 +10,49 @@ import operator
 from docutils.parsers.rst import directives as rst_directives
 from directives import NoninteractiveDirective, InteractiveDirective, WriteAllDirective
 from structure import FileSetManager
+from highlight import TokenCache, TokenStore
+from rawhtml import html_writers
+from db import default_budget
+from shared import default_budget as default_shared_budget
+from capture import default_output_limit
+from supervise import default_limits
 from docutils.parsers.rst import Directive, directives
 
 class WeaverContext(object):
     
-    def __init__(self, wd=None, languages=[]):
+    def __init__(self, wd=None, languages=[], cache_budget=default_budget,
+            debug_keys=False, shared_cache=None,
+            shared_cache_budget=default_shared_budget,
+            output_limit=default_output_limit, limits=default_limits,
+            output_format=None):
         languages = [lang(context = self) for lang in languages]
         self.languages = languages
+        self.cache_budget = cache_budget
+        self.debug_keys = debug_keys
+        self.shared_cache = shared_cache
+        self.shared_cache_budget = shared_cache_budget
+        self.output_limit = output_limit
+        self.limits = limits
+        # Directives write HTML themselves when it's going to an HTML writer
+        # (see rawhtml).
+        self.output_format = output_format
+        self.html_output = output_format in html_writers
+        # How many directives are running, one inside another's output.
+        self.nesting = 0
         
         if wd == None:
             wd = mkdtemp()
         
         self.wd = wd
         self.root_dir = wd
+        # Where output too long to show is put (see capture).
+        self.spill_dir = self.root_dir + '/output'
         
         makepdir(self.wd)
         makepdir(self.root_dir)
         
         self.fsm = FileSetManager(self)
+        self.tokens = TokenCache(TokenStore(self.root_dir + '/highlight.sqlite'))
         self.registered = False
     
     def register_global_directives(self):
@@ -81,7 +106,8 @@ class WeaverContext(object):
                     'name':      directives.unchanged,
                     'after':     directives.unchanged,
                     'in':        directives.unchanged,
-                    'highlight': directives.unchanged
+                    'highlight': directives.unchanged,
+                    'timeout':   float
                 }
                 self.name = name
 
@@ -99,6 +125,7 @@ class WeaverContext(object):
                 self.optional_arguments = 100
                 self.has_content = True
                 self.option_spec = {
+                    'timeout':   float
                 }
                 self.name = name
 
@@ -120,8 +147,8 @@ class WeaverContext(object):
 
         return Factory()
     
-    def run_cache(self, action, producer):
-        return self.fsm.run_cache(action, producer)
+    def run_cache(self, action, producer, full_key=None):
+        return self.fsm.run_cache(action, producer, full_key)
     
     def is_empty(self, source):
         return self.fsm.is_empty(source)
@@ -135,14 +162,15 @@ class WeaverContext(object):
     def restart(self, source):
         return self.fsm.restart(source)
     
-    def run(self, name, language):
-        return self.fsm.run(name, language)
+    def run(self, name, language, limits=None):
+        return self.fsm.run(name, language, limits or self.limits)
     
-    def compile(self, name, language):
-        return self.fsm.compile(name, language)
+    def compile(self, name, language, limits=None):
+        return self.fsm.compile(name, language, limits or self.limits)
         
-    def run_interactive(self, imports, lines, language):
-        return self.fsm.run_interactive(imports, lines, language)
+    def run_interactive(self, imports, lines, language, limits=None):
+        return self.fsm.run_interactive(imports, lines, language,
+            limits or self.limits)
     
     def write_all(self):
         self.fsm.write_all()
@@ -1,81 +1,224 @@
 
-import shelve
+import sqlite3
 import atexit
 import os
+import time
+import cPickle as pickle
 from utils import makepdir
-from collections import deque, namedtuple
+
+# Default on-disk budget for cached actions, in bytes.
+default_budget = 64 * 1024 * 1024
 
 def make_db(db_path):
     makepdir(os.path.dirname(db_path))
-    base = shelve.open(db_path)
-    handle = DictProxy(base)
+    handle = ActionStore(db_path)
     
     atexit.register(handle.close)
     
     return handle
 
-class DictProxy(object):
+class ActionStore(object):
     '''
-    This isn't actually about caching but about keeping identity.
+    Actions on disk, one row per Action.
+    
+    Rows are committed as soon as they are added, so nothing is lost if the
+    build dies, and they are only unpickled when their key is asked for.
+    
+    Along with the pickled Action each row keeps what eviction needs: its
+    size, what it cost to produce, how often it was reused and its priority.
+    
+    Keys are fingerprints (see WeaverDirective.run). The key they were made
+    from is only kept, in full_key, when debugging.
     '''
-    def __init__(self, dict):
-        self.dict  = dict
-        self.proxy = { }
     
-    def __getitem__(self, key):
-        if key not in self.proxy:
-            self.proxy[key] = self.dict[key]
-            
-        return self.proxy[key]
+    version = 8
     
-    def __setitem__(self, key, value):
-        self.proxy[key] = value
-        self.dict[key] = value
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.text_factory = str
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        
+        (version,) = self.conn.execute('PRAGMA user_version').fetchone()
+        if version != self.version:
+            self.create()
     
-    def __contains__(self, key):
-        return (key in self.proxy) or (key in self.dict)
+    def create(self):
+        with self.conn:
+            self.conn.execute('DROP TABLE IF EXISTS actions')
+            self.conn.execute('DROP TABLE IF EXISTS meta')
+            self.conn.execute('''
+                CREATE TABLE actions (
+                    id       INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key      TEXT NOT NULL,
+                    full_key TEXT,
+                    action   BLOB NOT NULL,
+                    size     INTEGER NOT NULL,
+                    cost     REAL NOT NULL,
+                    hits     INTEGER NOT NULL,
+                    used     REAL NOT NULL,
+                    priority REAL NOT NULL
+                )
+            ''')
+            self.conn.execute('CREATE INDEX actions_key ON actions (key)')
+            self.conn.execute(
+                'CREATE INDEX actions_priority ON actions (priority, used)')
+            self.conn.execute('''
+                CREATE TABLE meta (
+                    name  TEXT PRIMARY KEY,
+                    value REAL NOT NULL
+                )
+            ''')
+            self.conn.execute('PRAGMA user_version = %d' % self.version)
     
-    def close(self):
-        for key, value in self.proxy.items():
-            self.dict[key] = value
+    def load(self, key):
+        rows = self.conn.execute(
+            'SELECT id, action FROM actions WHERE key = ?',
+            (key,)
+        )
+        return [(id, pickle.loads(str(blob))) for id, blob in rows]
+    
+    def add(self, key, action, cost, full_key=None):
+        blob = pickle.dumps(action, pickle.HIGHEST_PROTOCOL)
+        size = len(blob)
+        if full_key != None:
+            full_key = repr(full_key)
+        with self.conn:
+            cursor = self.conn.execute('''
+                INSERT INTO actions
+                    (key, full_key, action, size, cost, hits, used, priority)
+                VALUES (?, ?, ?, ?, ?, 1, ?, ?)
+            ''', (
+                key, full_key, sqlite3.Binary(blob), size, cost,
+                time.time(), self.clock() + cost / size
+            ))
+        return cursor.lastrowid
+    
+    def touch(self, id):
+        with self.conn:
+            self.conn.execute('''
+                UPDATE actions
+                SET hits = hits + 1, used = ?,
+                    priority = ? + (hits + 1) * cost / size
+                WHERE id = ?
+            ''', (time.time(), self.clock(), id))
+    
+    def total_size(self):
+        (size,) = self.conn.execute(
+            'SELECT coalesce(sum(size), 0) FROM actions').fetchone()
+        return size
+    
+    def victims(self, budget):
+        '''
+        Ids of the rows to drop to get under `budget` bytes, least valuable
+        first. Ties on priority go to the least recently used.
+        '''
+        excess = self.total_size() - budget
+        if excess <= 0:
+            return [ ]
         
-        self.dict.close()
+        ids = [ ]
+        clock = self.clock()
+        rows = self.conn.execute(
+            'SELECT id, size, priority FROM actions ORDER BY priority, used')
+        for id, size, priority in rows:
+            if excess <= 0:
+                break
+            ids.append(id)
+            excess -= size
+            clock = max(clock, priority)
+        
+        self.set_clock(clock)
+        return ids
+    
+    def clock(self):
+        row = self.conn.execute(
+            "SELECT value FROM meta WHERE name = 'clock'").fetchone()
+        return row[0] if row != None else 0.0
+    
+    def set_clock(self, value):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (name, value) VALUES ('clock', ?)",
+                (value,))
+    
+    def remove(self, ids):
+        with self.conn:
+            self.conn.executemany(
+                'DELETE FROM actions WHERE id = ?',
+                [(id,) for id in ids]
+            )
+    
+    def close(self):
+        self.conn.close()
 
 class ActionCache(object):
+    '''
+    Cached actions, evicted greedy-dual-size-frequency style: an entry's
+    priority is the running clock plus hits * cost / size, the clock rises to
+    the priority of whatever was last evicted, and the lowest priorities go
+    first once the store is over `budget` bytes. So expensive, small,
+    often-reused runs stay, and anything not reused eventually ages out.
+    '''
     
-    def __init__(self, size=100):
-        self.time_list = deque([None] * size)
+    def __init__(self, store, budget=default_budget):
+        self.store   = store
+        self.budget  = budget
         self.actions = { }
+        self.ids     = { }
+        self.rows    = { }
     
-    def __setitem__(self, key, value):
-        value_set = self.actions.get(key, set())
+    def add(self, key, value, cost, full_key=None):
+        value_set = self[key]
         
-        if value not in value_set:
-            self.push(key, value)
+        if value in value_set:
+            return
         
+        id = self.store.add(key, value, cost, full_key)
         value_set.add(value)
-        self.actions[key] = value_set
+        self.ids[id] = (key, value)
+        self.rows[(key, value)] = id
+        
+        self.evict()
+    
+    def __setitem__(self, key, value):
+        self.add(key, value, 0.0)
     
     def __getitem__(self, key):
-        return self.actions.get(key, set())
-    
-    def push(self, new_key, new_value):
-        left = self.time_list.popleft()
-        if left != None:
-            (last_key, last_value) = left
-            
-            value_set = self.actions.get(last_key, set())
-            value_set.remove(last_value)
-            
-            if len(value_set) == 0:
-                del self.actions[last_key]
-            
-        self.time_list.append((new_key, new_value))
+        if key not in self.actions:
+            value_set = set()
+            for id, value in self.store.load(key):
+                value_set.add(value)
+                self.ids[id] = (key, value)
+                self.rows[(key, value)] = id
+            self.actions[key] = value_set
+        
+        return self.actions[key]
+    
+    def touch(self, key, value):
+        '''
+        Record that a cached action was reused.
+        '''
+        id = self.rows.get((key, value))
+        if id != None:
+            self.store.touch(id)
+    
+    def evict(self):
+        old = self.store.victims(self.budget)
+        if len(old) == 0:
+            return
+        
+        self.store.remove(old)
+        
+        for id in old:
+            if id in self.ids:
+                (last_key, last_value) = self.ids.pop(id)
+                del self.rows[(last_key, last_value)]
+                self.actions[last_key].discard(last_value)
 
 class Action(object):
     
     def __init__(self, inputs, outputs, output):
-        self.inputs  = tuple(inputs)
+        self.inputs  = tuple(sorted(inputs))
         self.outputs = outputs
         self.output  = output
         
@@ -93,4 +236,3 @@ class Action(object):
     def __repr__(self):
         return self.__str__()
 
-
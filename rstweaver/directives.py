@@ -4,7 +4,9 @@ from docutils import nodes
 from structure import Block
 from uuid import uuid4
 import re
-from highlight import highlight_as
+from highlight import highlight_tokens, token_nodes, number_lines
+import rawhtml
+from utils import fingerprint
 
 class WeaverDirective(Directive):
     
@@ -18,21 +20,58 @@ class WeaverDirective(Directive):
         options = self.options
         content = self.content
         
-        key = (
+        full_key = (
             self.directive_name,
             tuple(args),
-            tuple(options.items()),
+            tuple(sorted(options.items())),
             tuple(content)
         )
         
-        output = self.context.run_cache(
-            key,
-            lambda: self.handle(args, options, content)
-        )
-        return output
+        # The cache only sees a digest of the key, so the directive's source
+        # isn't stored (and compared) again with every action. What it keeps
+        # is the same for every writer; nodes are made from it afterwards.
+        cx = self.context
+        cx.nesting += 1
+        try:
+            result = cx.run_cache(
+                fingerprint(full_key),
+                lambda: self.handle(args, options, content),
+                full_key
+            )
+        finally:
+            cx.nesting -= 1
+        
+        return self.render(result)
     
     def handle(self, args, options, content):
+        '''
+        Run the directive. Returns what render() makes nodes of.
+        '''
         raise NotImplementedError
+    
+    def render(self, result):
+        '''
+        Nodes for what handle() returned; by default it returns nodes.
+        '''
+        return result
+    
+    def html_output(self):
+        '''
+        Whether to render straight to HTML (see rawhtml): when the document
+        is going to an HTML writer, and this directive's nodes aren't going
+        into another's output (which is cached for every writer alike).
+        '''
+        return self.context.html_output and self.context.nesting == 0
+    
+    def limits(self, options):
+        '''
+        The context's limits on runs, with this directive's :timeout: (in
+        seconds, 0 for none).
+        '''
+        limits = self.context.limits
+        if 'timeout' in options:
+            limits = limits._replace(timeout = options['timeout'] or None)
+        return limits
 
 class NoninteractiveDirective(WeaverDirective):
     
@@ -66,63 +105,85 @@ class NoninteractiveDirective(WeaverDirective):
             input_display  = self.do_mods(source_name, commands, options, content)
             output_display = self.do_run(source_name, commands, options, content)
             
-        if 'join' in commands: header_node = nodes.inline()
+        if 'noecho' in commands: return None
+        
+        if 'join' in commands:
+            header_text = ''
         else:
             cont = '(cont)' if not was_empty else ''
             header_text = '     %s %s\n\n' % (source_name, cont)
-            header_node = nodes.inline(
-                header_text, header_text, classes=['file-header']
-            )
         
         if input_display != None:
-            source_nodes = []
-            for sblock in input_display:
-                if sblock.name == None:
-                    btext = sblock.text()
-                    if 'highlight' in options:
-                        hlbtext = highlight_as(btext, options['highlight'])
-                    else:
-                        hlbtext = self.language.highlight(sblock.text())
-                    source_nodes +=  hlbtext
-                else:
-                    source_nodes += [nodes.inline('',
-                        '[... %s ...]' % sblock.name,
-                        classes = ['omission']
-                    ), nodes.inline('\n', '\n')]
-                    
-            if self.language.number_lines():
-                source_nodes = add_line_numbers(source_nodes, was_lines+1)
-            
-            source_node = nodes.literal_block(
-                classes=['code', 'code-' + self.directive_name])
-            source_node += header_node
-            for n in source_nodes:
-                source_node += n
+            tokens = self.source_tokens(input_display, options, was_lines)
         else:
-            source_node = None
+            tokens = None
+        
+        if isinstance(output_display, str):
+            output_display = strip_blank_lines(output_display)
+            try:
+                output_display = output_display.decode('utf-8')
+            except UnicodeDecodeError:
+                output_display = output_display.decode('ascii', 'ignore')
         
-        if output_display != None:
-            if isinstance(output_display, str):
-                output = strip_blank_lines(output_display)
-                try:
-                    output = output.decode('utf-8')
-                except:
-                    output = filter(lambda c: ord(c)<128, output)
-                output_node = nodes.literal_block(output, output,
-                    classes=['run-output', 'run-output-' + self.directive_name]
-                )
+        # Output is text, or nodes from languages that make their own
+        # (weaver).
+        return (header_text, tokens, output_display)
+    
+    def render(self, result):
+        if result == None:
+            return [ ]
+        header_text, tokens, output_display = result
+        
+        result_nodes = [ ]
+        
+        if tokens != None:
+            classes = ['code', 'code-' + self.directive_name]
+            if self.html_output():
+                body = rawhtml.tokens_html(tokens)
+                if header_text:
+                    body = rawhtml.span('file-header', header_text) + body
+                source_node = rawhtml.literal_block(classes, body)
             else:
-                output_node = output_display
-        else:
-            output_node = None
+                source_node = nodes.literal_block(classes=classes)
+                if header_text:
+                    source_node += nodes.inline(
+                        header_text, header_text, classes=['file-header'])
+                else:
+                    source_node += nodes.inline()
+                for n in token_nodes(tokens):
+                    source_node += n
+            result_nodes.append(source_node)
         
-        if 'noecho' in commands: return [ ]
-        else:
-            result = []
-            if source_node != None: result.append(source_node)
-            if output_node != None: result.append(output_node)
+        if isinstance(output_display, basestring):
+            result_nodes.append(nodes.literal_block(output_display, output_display,
+                classes=['run-output', 'run-output-' + self.directive_name]))
+        elif output_display != None:
+            result_nodes.append(output_display)
         
-            return result
+        return result_nodes
+    
+    def source_tokens(self, input_display, options, was_lines):
+        '''
+        The highlighted tokens of the listing, numbered if the language
+        numbers lines.
+        '''
+        tokens = [ ]
+        for sblock in input_display:
+            if sblock.name == None:
+                btext = sblock.text()
+                if 'highlight' in options:
+                    tokens += highlight_tokens(btext, options['highlight'],
+                        self.context.tokens)
+                else:
+                    tokens += self.language.highlight_tokens(btext)
+            else:
+                tokens += [('omission', '[... %s ...]' % sblock.name),
+                    (None, '\n')]
+        
+        if self.language.number_lines():
+            tokens = list(number_lines(tokens, was_lines+1))
+        
+        return tokens
     
     def do_recall(self, source, commands, options, content):
         block_name = (self.options['name']
@@ -157,41 +218,15 @@ class NoninteractiveDirective(WeaverDirective):
     
     def do_run(self, source, commands, options, content):
         if 'done' in commands:
-            return self.context.compile(source, self.language)
+            return self.context.compile(source, self.language,
+                self.limits(options))
         
         elif 'exec' in commands:
-            return self.context.run(source, self.language)
+            return self.context.run(source, self.language,
+                self.limits(options))
     
     def expand_subparts(self, lines, block_name):
-        leading = ()
-        parts   = ()
-        
-        while 1:
-            if len(lines) == 0:
-                if len(leading) > 0:
-                    back = Block.with_lines(None, leading)
-                    parts = parts + (back,)
-                break
-            
-            else:
-                head = lines[0]
-                rest = lines[1:]
-                match = re.match(r'^\s*\<\<\<([^\>]*)\>\>\>\s*$', head)
-                
-                if match != None:
-                    back = Block.with_lines(None, leading)
-                    leading = ()
-                    
-                    takeout = Block.empty(match.groups(1)[0])
-                    parts = parts + (back,takeout)
-                
-                else:
-                    head = re.subn(r'\<\<\<\<([^\>]*)\>\>\>\>', r'<<<\1>>>', head)[0]
-                    leading = leading + (head,)
-                
-                lines = rest
-        
-        return Block.with_parts(block_name, parts)
+        return Block.parse(block_name, lines)
 
 class InteractiveDirective(WeaverDirective):
 
@@ -205,27 +240,42 @@ class InteractiveDirective(WeaverDirective):
         file_like_args = args
         lines = map(str, content)
         
-        output_lines = cx.run_interactive(file_like_args, lines, self.language)
+        output_lines = cx.run_interactive(file_like_args, lines, self.language,
+            self.limits(options))
         if len(output_lines) < len(lines):
             output_lines = output_lines + ([''] * (len(lines) - len(output_lines)))
         
+        session = [ ]
+        for k in range(len(lines)):
+            tokens = self.language.highlight_tokens(lines[k].rstrip().lstrip())
+            
+            output_line = output_lines[k]
+            if isinstance(output_line, str):
+                output_line = output_line.decode('ascii', 'ignore')
+            
+            session.append((tokens, output_line))
+        
+        return session
+    
+    def render(self, session):
+        if self.html_output():
+            return [self.session_html(session)]
+        
         sess_nodes = []
+        
+        for k in range(len(session)):
+            tokens, output_line = session[k]
             
-        for k in range(len(lines)):
             input_node = nodes.inline(classes = ['interactive-input'])
             input_node += nodes.inline('', self.language.interactive_prompt())
-            for n in self.language.highlight(lines[k].rstrip().lstrip()):
+            for n in token_nodes(tokens):
                 input_node += n
             
-            output_line = output_lines[k]
-            output_line = filter(
-                lambda c: ord(c) < 128, output_line
-            )
             output_node = nodes.inline('', output_line,
                 classes = ['interactive-output'])
             
             sess_nodes += [input_node, nodes.inline('\n','\n'), output_node]
-            if k < len(lines)-1:
+            if k < len(session)-1:
                 sess_nodes += [nodes.inline('\n\n','\n\n')]
         
         all_node = nodes.literal_block(classes=['interactive-session'])
@@ -233,6 +283,22 @@ class InteractiveDirective(WeaverDirective):
             all_node += n
             
         return [all_node]
+    
+    def session_html(self, session):
+        '''
+        The same session as the nodes made in render(), as one raw node.
+        '''
+        prompt = self.language.interactive_prompt()
+        
+        parts = [ ]
+        for tokens, output_line in session:
+            parts.append('%s\n%s' % (
+                rawhtml.wrap('interactive-input',
+                    rawhtml.escape(prompt) + rawhtml.tokens_html(tokens)),
+                rawhtml.span('interactive-output', output_line)
+            ))
+        
+        return rawhtml.literal_block(['interactive-session'], '\n\n'.join(parts))
 
 class WriteAllDirective(WeaverDirective):
     
@@ -248,34 +314,6 @@ def strip_blank_lines(text):
     text = re.sub(r'\n\s*$', '', text)
     return text
 
-def add_line_numbers(toks, start):
-    def ln(n):
-        return nodes.inline('', '%3d  ' % n, classes=['lineno'])
-    
-    def gen():
-        yield ln(start)
-        line = start + 1
-        for j in range(len(toks)):
-            node = toks[j]
-            
-            text = node.rawsource
-            parts = text.split('\n')
-            
-            if len(parts) == 1:
-                yield node
-            else:
-                classes = node.attributes['classes']
-                
-                for k in range(len(parts)):
-                    yield nodes.inline('', parts[k], classes=classes)
-                    if k < len(parts)-1:
-                        yield nodes.inline('\n', '\n')
-                        if k < len(parts)-2 or j < len(toks)-1:
-                            yield ln(line)
-                        line += 1
-        
-    return list(gen())
-
 def unique_block_id():
     return uuid4().hex[:4]
 
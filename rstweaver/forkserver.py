@@ -0,0 +1,153 @@
+
+'''
+Running Python blocks without starting a new interpreter for each.
+
+A ForkServer is a Python process (see pyserver) that has already started up
+and imported whatever blocks are likely to import. Each block is run in a
+child forked from it, so all that is paid per block is the fork.
+
+The child writes its output to a pair of FIFOs, which are read here just as
+a Popen's pipes would be: start() returns something that looks enough like a
+Popen for WeaverLanguage.communicate() (and its timeout, which kills the
+child's process group).
+
+Children aren't started through WeaverLanguage.popen(), so files they look
+for and don't find aren't traced.
+'''
+
+import os
+import json
+import fcntl
+import shutil
+import atexit
+import threading
+from tempfile import mkdtemp
+from subprocess import Popen, PIPE
+import supervise
+
+server_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pyserver.py')
+
+class ServerGone(Exception):
+    pass
+
+class Forked(object):
+    '''
+    A child of the server, standing in for a Popen.
+    '''
+    
+    def __init__(self, pid, stdout, stderr):
+        self.pid    = pid
+        self.stdin  = None
+        self.stdout = stdout
+        self.stderr = stderr
+    
+    def wait(self):
+        # The server reaps its children; once their output has ended there
+        # is nothing to wait for.
+        return None
+
+class ForkServer(object):
+    
+    def __init__(self, command, preimports):
+        with open(os.devnull, 'w') as null:
+            self.proc = Popen(
+                list(command) + [server_script] + list(preimports),
+                stdin  = PIPE,
+                stdout = PIPE,
+                stderr = null,
+                close_fds = True
+            )
+        self.lock = threading.Lock()
+    
+    def start(self, mode, path, wd):
+        '''
+        Run (mode 'run') or just compile (mode 'compile') path in wd, in a
+        new child, under the current thread's limits (see supervise).
+        
+        Returns:
+            Forked.
+        '''
+        fifo_dir = mkdtemp(prefix='rstweaver-fork-')
+        try:
+            out = os.path.join(fifo_dir, 'out')
+            err = os.path.join(fifo_dir, 'err')
+            os.mkfifo(out)
+            os.mkfifo(err)
+            
+            # Opened before the child exists (which needs O_NONBLOCK), so
+            # that opening them for writing doesn't wait for us.
+            out_fd = os.open(out, os.O_RDONLY | os.O_NONBLOCK)
+            err_fd = os.open(err, os.O_RDONLY | os.O_NONBLOCK)
+            
+            limits = supervise.current()
+            request = json.dumps({
+                'mode':   mode,
+                'path':   path,
+                'wd':     os.path.abspath(wd),
+                'out':    out,
+                'err':    err,
+                'cpu':    limits.cpu,
+                'memory': limits.memory
+            })
+            
+            with self.lock:
+                try:
+                    self.proc.stdin.write(request + '\n')
+                    self.proc.stdin.flush()
+                    reply = self.proc.stdout.readline()
+                except IOError:
+                    reply = ''
+            
+            if reply == '':
+                os.close(out_fd)
+                os.close(err_fd)
+                raise ServerGone()
+            
+            for fd in (out_fd, err_fd):
+                flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+                fcntl.fcntl(fd, fcntl.F_SETFL, flags & ~os.O_NONBLOCK)
+            
+            return Forked(int(reply), os.fdopen(out_fd, 'rb'), os.fdopen(err_fd, 'rb'))
+        finally:
+            shutil.rmtree(fifo_dir, True)
+    
+    def close(self):
+        try:
+            self.proc.stdin.close()
+        except IOError:
+            pass
+        self.proc.wait()
+
+servers = { }
+servers_lock = threading.Lock()
+
+def server(command, preimports):
+    '''
+    The server for command with preimports, started if need be, or None
+    if it has stopped working.
+    '''
+    key = (tuple(command), tuple(preimports))
+    with servers_lock:
+        if key not in servers:
+            try:
+                servers[key] = ForkServer(command, preimports)
+            except OSError:
+                servers[key] = None
+        return servers[key]
+
+def forget(command, preimports):
+    '''
+    Stop using a server that has gone away.
+    '''
+    with servers_lock:
+        servers[(tuple(command), tuple(preimports))] = None
+
+def close_all():
+    with servers_lock:
+        for server in servers.values():
+            if server != None:
+                server.close()
+        servers.clear()
+
+atexit.register(close_all)
+
@@ -1,24 +1,232 @@
 
+'''
+Turning code into docutils nodes, one per token.
+
+Lexers are made once per language and reused, and the tokens of code that
+has been highlighted before are looked up rather than lexed again: first in
+a TokenCache held in memory, then in the TokenStore it was given, if any (the
+weaver context keeps one in the weaver dir, next to the cache of runs).
+'''
+
 import pygments
 from pygments.lexers import get_lexer_by_name
 from pygments.formatters.html import _get_ttype_class
 import re
+import os
+import time
+import sqlite3
+import atexit
+import threading
+import cPickle as pickle
+from collections import OrderedDict
 from docutils import nodes
+from utils import makepdir, fingerprint
+
+lexers = { }
+lexers_lock = threading.Lock()
+
+def lexer(lang):
+    '''
+    The lexer for lang, made the first time it's asked for. Lexers keep no
+    state from one text to the next, so one will do for every caller.
+    '''
+    with lexers_lock:
+        if lang not in lexers:
+            lexers[lang] = get_lexer_by_name(lang)
+        return lexers[lang]
+
+def lex(code, lang):
+    '''
+    Returns:
+        [(CSS class, text)] for the tokens of code.
+    '''
+    tokens = list(pygments.lex(code, lexer(lang)))[:-1]
+    return [(_get_ttype_class(ttype), text) for ttype, text in tokens]
+
+class TokenStore(object):
+    '''
+    Token lists on disk, one row per (language, digest of code), keeping up
+    to `limit` of the most recently used.
+    
+    Nothing is written until close(): new rows and the times rows were used
+    are kept in memory and written in one transaction then, so that looking
+    tokens up costs less than lexing them again.
+    '''
+    
+    version = 1
+    
+    def __init__(self, path, limit=16384):
+        makepdir(os.path.dirname(path))
+        self.limit = limit
+        self.added = { }
+        self.used  = { }
+        self.conn = sqlite3.connect(path)
+        self.conn.text_factory = str
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        
+        (version,) = self.conn.execute('PRAGMA user_version').fetchone()
+        if version != self.version:
+            self.create()
+        
+        atexit.register(self.close)
+    
+    def create(self):
+        with self.conn:
+            self.conn.execute('DROP TABLE IF EXISTS tokens')
+            self.conn.execute('''
+                CREATE TABLE tokens (
+                    lang   TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    tokens BLOB NOT NULL,
+                    used   REAL NOT NULL,
+                    PRIMARY KEY (lang, digest)
+                )
+            ''')
+            self.conn.execute('CREATE INDEX tokens_used ON tokens (used)')
+            self.conn.execute('PRAGMA user_version = %d' % self.version)
+    
+    def get(self, lang, digest):
+        key = (lang, digest)
+        if key in self.added:
+            return self.added[key]
+        
+        row = self.conn.execute(
+            'SELECT tokens FROM tokens WHERE lang = ? AND digest = ?',
+            key
+        ).fetchone()
+        if row == None:
+            return None
+        
+        self.used[key] = time.time()
+        return pickle.loads(str(row[0]))
+    
+    def put(self, lang, digest, tokens):
+        self.added[(lang, digest)] = tokens
+    
+    def close(self):
+        if self.conn == None:
+            return
+        
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                'UPDATE tokens SET used = ? WHERE lang = ? AND digest = ?',
+                [(used, lang, digest)
+                    for (lang, digest), used in self.used.items()])
+            self.conn.executemany('''
+                INSERT OR REPLACE INTO tokens (lang, digest, tokens, used)
+                VALUES (?, ?, ?, ?)
+            ''', [
+                (lang, digest, sqlite3.Binary(
+                    pickle.dumps(tokens, pickle.HIGHEST_PROTOCOL)), now)
+                for (lang, digest), tokens in self.added.items()
+            ])
+            
+            # Trimmed once, at the end, rather than on every put.
+            self.conn.execute('''
+                DELETE FROM tokens WHERE rowid NOT IN (
+                    SELECT rowid FROM tokens ORDER BY used DESC LIMIT ?
+                )
+            ''', (self.limit,))
+        self.conn.close()
+        self.conn = None
 
-def highlight_as(code, lang):
+class TokenCache(object):
+    '''
+    The tokens of the `size` most recently highlighted pieces of code, in
+    front of an optional TokenStore.
+    '''
+    
+    def __init__(self, store=None, size=4096):
+        self.store   = store
+        self.size    = size
+        self.entries = OrderedDict()
     
-        left_space  = re.search(r'^(\s*)', code).group(1)
-        right_space = re.search(r'(\s*)$', code).group(1)
-        inner_code = code.lstrip().rstrip()
-        tokens = list(pygments.lex(inner_code, get_lexer_by_name(lang)))[:-1]
+    def tokens(self, code, lang):
+        key = (lang, fingerprint(code))
         
-        def make_nodes():
-            yield nodes.inline(left_space, left_space)
-            for ttype, text in tokens:
-                yield nodes.inline(text, text, classes=[
-                    _get_ttype_class(ttype)
-                ])
-            yield nodes.inline(right_space, right_space)
+        tokens = self.entries.pop(key, None)
+        if tokens == None and self.store != None:
+            tokens = self.store.get(*key)
+        if tokens == None:
+            tokens = lex(code, lang)
+            if self.store != None:
+                self.store.put(lang, key[1], tokens)
+        
+        self.entries[key] = tokens
+        if len(self.entries) > self.size:
+            self.entries.popitem(last = False)
+        
+        return tokens
+
+default_cache = TokenCache()
+
+def highlight_tokens(code, lang, cache=None):
+    '''
+    Parameters:
+        cache -- The TokenCache to look code up in (the weaver context's
+          tokens, say); by default one kept in memory only.
+    
+    Returns:
+        [(CSS class or None, text)] for code, leading and trailing space
+        included.
+    '''
+    if cache == None:
+        cache = default_cache
+    
+    left_space  = re.search(r'^(\s*)', code).group(1)
+    right_space = re.search(r'(\s*)$', code).group(1)
+    inner_code = code.lstrip().rstrip()
+    
+    return ([(None, left_space)]
+        + cache.tokens(inner_code, lang)
+        + [(None, right_space)])
+
+def highlight_as(code, lang, cache=None):
+    '''
+    One docutils node per token of code; see highlight_tokens.
+    '''
+    return token_nodes(highlight_tokens(code, lang, cache))
+
+def token_nodes(tokens):
+    return [
+        nodes.inline(text, text, classes=[ttype_class] if ttype_class else [ ])
+        for ttype_class, text in tokens
+    ]
+
+def number_lines(tokens, start):
+    '''
+    tokens with a ('lineno', number) token at the start of each line, the
+    first being start, in one pass. A token running over several lines is
+    cut at its newlines, each piece keeping its newline, so that every line
+    gets its number without anything else being added.
+    '''
+    def ln(n):
+        return ('lineno', '%3d  ' % n)
+    
+    yield ln(start)
+    line = start + 1
+    last = len(tokens) - 1
+    for j, (css_class, text) in enumerate(tokens):
+        if '\n' not in text:
+            yield (css_class, text)
+            continue
         
-        return list(make_nodes())
+        parts = text.split('\n')
+        for k in range(len(parts)-1):
+            yield (css_class, parts[k] + '\n')
+            # No number after the listing's final newline.
+            if k < len(parts)-2 or j < last:
+                yield ln(line)
+            line += 1
+        if parts[-1]:
+            yield (css_class, parts[-1])
 
+def node_tokens(toks):
+    '''
+    The other way: tokens for a list of inline nodes.
+    '''
+    return [
+        (' '.join(node['classes']) or None, node.astext())
+        for node in toks
+    ]
@@ -1,10 +1,14 @@
 
-from highlight import highlight_as
+from highlight import highlight_as, highlight_tokens, node_tokens
 from docutils import nodes
 from uuid import uuid4
 import re
-import operator
 from subprocess import Popen, PIPE, STDOUT
+import probes
+import capture
+import supervise
+from chop import Chopper
+import sessions
 
 class WeaverLanguage(object):
     '''
@@ -29,6 +33,15 @@ class WeaverLanguage(object):
     noninteractive = 1
     interactive    = 2
     
+    # Whether runs may happen on another thread, in a directory of their own,
+    # while the document is still being read (see rst_to_doc's jobs). Turn
+    # this off if running needs the weaver context itself.
+    parallel = True
+    
+    # How to find out which files a run read and wrote (see trackers).
+    # 'strace' is cheaper, but only sees processes started with self.popen().
+    tracker = 'inotify'
+    
     def __init__(self, directives, context):
         self.directives = directives
         self.context    = context
@@ -98,7 +111,8 @@ class WeaverLanguage(object):
     
     def chopped_interactive(
         self, lines, put_id, get_id,
-        preamble, wrap_line, command, wd
+        preamble, wrap_line, command, wd,
+        reset=None, imports=[]
     ):
         '''
         Run an interactive session by a hacky uuid-chopping method.
@@ -129,39 +143,130 @@ class WeaverLanguage(object):
               producing the text that will be sent to the interpreter.
             command - command to sent to Popen (so command + args as a list)
             wd - Working directory path.
+            reset - Text that puts a running interpreter back the way it was
+              when it started, or None if there isn't any. If there is, the
+              interpreter is kept running afterwards and used again for the
+              next session with the same command, wd and preamble (see
+              sessions).
+            imports - Files the preamble loads; a kept interpreter isn't
+              used again once one of them has changed.
         
-        And this will return the corresponding output lines.
+        And this will return the corresponding output lines (or, if the
+        interpreter never got as far as the first line, all its output as
+        the first).
         '''
         ids = [uuid4().hex for j in range(len(lines)+1)]
-        input = (
-              preamble
-            + reduce(operator.add, [
+        body = ''.join(
+            [put_id(ids[0])] + [
                   wrap_line(lines[k].rstrip().lstrip()) + '\n'
                 + put_id(ids[k+1])
                 for k in range(len(lines))
-            ], put_id(ids[0]))
+            ]
         )
         
-        proc = Popen(
-            command,
-            stdin  = PIPE,
-            stdout = PIPE,
-            stderr = STDOUT,
-            cwd = wd
+        chopper = Chopper(ids, get_id,
+            self.context.output_limit, self.context.spill_dir)
+        
+        if reset == None:
+            proc = self.popen(
+                command,
+                stdin  = PIPE,
+                stdout = PIPE,
+                stderr = STDOUT,
+                cwd = wd
+            )
+            
+            self.communicate(proc, preamble + body, sink = chopper)
+        else:
+            self.pooled_interactive(
+                preamble, body, chopper, command, wd, reset, imports
+            )
+        
+        if chopper.current == None:
+            # Not even the first delimiter came out.
+            return [chopper.unchopped()]
+        return [l.rstrip().lstrip() for l in chopper.lines()]
+    
+    def pooled_interactive(
+        self, preamble, body, chopper, command, wd, reset, imports
+    ):
+        '''
+        Feed preamble + body to a kept interpreter (starting one if there
+        isn't one to hand), passing its output to chopper until that has
+        seen the end of the session.
+        
+        Kept interpreters aren't started through self.popen(), since they
+        outlive the run; files they look for and don't find go unnoticed, and
+        only the timeout applies to them (CPU and memory limits would add up
+        over the sessions they serve). One that is killed, or that a line
+        printed too much in, isn't kept.
+        '''
+        key   = (tuple(command), wd, preamble)
+        stamp = sessions.import_stamp(wd, imports)
+        
+        session = sessions.pool.take(key, stamp)
+        if session == None:
+            session = sessions.Session(command, wd, stamp)
+            input = preamble + body
+        else:
+            input = reset + preamble + body
+        
+        with supervise.watchdog(session.proc) as dog:
+            session.exchange(input, chopper)
+        if dog.fired:
+            chopper.feed(dog.note())
+        
+        if chopper.finished and not chopper.overflowed():
+            sessions.pool.give(key, session)
+        else:
+            session.close()
+    
+    def popen(self, command, **options):
+        '''
+        Start a process, like subprocess.Popen(command, **options).
+        
+        Use this rather than Popen directly, so that rstweaver can see which
+        files the process looked for and didn't find (see caching), and so
+        that the run's limits apply to it (see supervise). Use
+        self.communicate() to read its output.
+        '''
+        return Popen(
+            probes.wrap(command),
+            preexec_fn = supervise.preexec(supervise.current()),
+            **options
         )
+    
+    def communicate(self, proc, input=None, limit=None, sink=None):
+        '''
+        Like proc.communicate(input), but without holding on to more output
+        than anyone will read: past the context's output_limit (or limit, if
+        given; 0 for output that is used rather than shown), only the start
+        and end of each stream are kept, and the whole of it is put in a file
+        in the weaver dir. With sink (a chop.Chopper, say), stdout is fed to
+        it as it comes instead of being returned.
         
-        out, err = proc.communicate(input)
+        If the run's timeout passes first (it counts from the start of the
+        run, not of proc), proc and everything it started are killed, and a
+        note saying so is added to the output.
+        '''
+        with supervise.watchdog(proc) as dog:
+            out, err = capture.communicate(
+                proc,
+                input,
+                self.context.output_limit if limit == None else limit,
+                self.context.spill_dir,
+                sink
+            )
         
-        out_lines = [None] * len(lines)
+        if dog.fired:
+            if sink != None:
+                sink.feed(dog.note())
+            elif out != None:
+                out += dog.note()
+            elif err != None:
+                err += dog.note()
         
-        try:
-            [_,rest] = out.split(get_id(ids[0]))
-            for k in range(len(lines)):
-                [out_lines[k], rest] = rest.split(get_id(ids[k+1]))
-            
-            return [l.rstrip().lstrip() for l in out_lines]
-        except:
-            return [out]
+        return (out, err)
     
     def highlight_lang(self, code):
         '''
@@ -183,7 +288,20 @@ class WeaverLanguage(object):
         Required for:
             All
         '''
-        return highlight_as(code, self.highlight_lang())
+        return highlight_as(code, self.highlight_lang(), self.context.tokens)
+    
+    def highlight_tokens(self, code):
+        '''
+        The same as highlight(), but as [(CSS class or None, text)], for
+        writing HTML directly (see rawhtml).
+        
+        There's no need to implement this: by default it comes from the
+        lexer for self.highlight_lang(), or, if highlight() is overridden,
+        from the nodes that returns.
+        '''
+        if self.highlight.im_func is not WeaverLanguage.highlight.im_func:
+            return node_tokens(self.highlight(code))
+        return highlight_tokens(code, self.highlight_lang(), self.context.tokens)
     
     def css(self):
         '''
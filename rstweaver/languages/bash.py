@@ -1,11 +1,13 @@
 
 from rstweaver  import WeaverLanguage
-from subprocess import Popen, PIPE, STDOUT
+from subprocess import PIPE, STDOUT
 import re
 import operator
 
 class Bash(WeaverLanguage):
     
+    tracker = 'strace'
+    
     def __init__(self, **other_options):
         WeaverLanguage.__init__(self, {
             WeaverLanguage.noninteractive: 'bash',
@@ -15,14 +17,14 @@ class Bash(WeaverLanguage):
         )
     
     def run(self, path, wd):
-        proc = Popen(
+        proc = self.popen(
             ['bash', path],
             stdout = PIPE,
             stderr = PIPE,
             cwd = wd
         )
         
-        out, err = proc.communicate()
+        out, err = self.communicate(proc)
         
         return err + out
     
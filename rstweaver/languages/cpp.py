@@ -1,12 +1,18 @@
 
 from rstweaver  import WeaverLanguage
-from subprocess import Popen, PIPE, STDOUT
+from rstweaver.buildcache import compile_object, link_program, build_program, \
+    precompile_header, source_file
+from rstweaver.chop import Chopper
+from subprocess import PIPE, STDOUT
 import re
 from uuid import uuid4
-import operator
 
 class CPP(WeaverLanguage):
     
+    # Only compilers and programs started with self.popen() touch files in
+    # wd; icpp's main() is written to the build cache (see source_file).
+    tracker = 'strace'
+    
     def __init__(self, **other_options):
         WeaverLanguage.__init__(self, {
             WeaverLanguage.noninteractive: 'cpp',
@@ -16,39 +22,26 @@ class CPP(WeaverLanguage):
         )
     
     def test_compile(self, path, wd):
-        proc = Popen(
-            ['g++', '-c', '-o', '/dev/null', path],
-            stdout = PIPE,
-            stderr = PIPE,
-            cwd = wd
-        )
+        built = compile_object(self.popen, self.communicate, 'g++', [ ],
+            path, wd)
         
-        out, err = proc.communicate()
-        
-        return err + out
+        return built.messages
     
     def run(self, path, wd):
-        proc = Popen(
-            ['g++', '-o', 'main', path],
-            stdout = PIPE,
-            stderr = PIPE,
-            cwd = wd
-        )
-        
-        out, err = proc.communicate()
-        status = proc.wait()
+        built = build_program(self.popen, self.communicate, 'g++', [ ],
+            [path], wd)
         
-        if status != 0:
-            return err + out
+        if built.status != 0:
+            return built.messages
         
-        proc = Popen(
-            ['./main'],
+        proc = self.popen(
+            [built.path],
             stdout = PIPE,
             stderr = PIPE,
             cwd = wd
         )
         
-        out, err = proc.communicate()
+        out, err = self.communicate(proc)
         
         return err + out
     
@@ -62,57 +55,59 @@ class CPP(WeaverLanguage):
             return 'std::cout << "%s\\n";\n' % id
         pids = map(print_id, ids)
         
-        def include(path):
-            return '#include "%s"\n' % path
-        includes = reduce(operator.add, map(include, ['iostream'] + includes))
+        # The headers are parsed once, into a precompiled header shared by
+        # every directive with the same includes; only main() is compiled
+        # each time.
+        quote = ['-iquote', '.']
+        header = precompile_header(self.popen, self.communicate, 'g++', quote,
+            ['iostream'] + includes, wd)
+        
+        if header.status != 0:
+            return [header.messages] + ([''] * (len(lines)-1))
         
-        input = (
-              includes
-            + '\n\nint main() {\n'
-            + reduce(operator.add, [
+        input = ''.join(
+            ['int main() {\n', pids[0]] + [
                   lines[k].rstrip().lstrip() + ';\n'
                 + pids[k+1]
                 for k in range(len(lines))
-            ], pids[0])
-            + '\n}\n'
+            ] + ['\n}\n']
         )
         
-        with open(wd + '/main.cpp', 'w') as hl:
-            hl.write(input)
+        main = source_file(input, '.cpp')
         
-        proc = Popen(
-            ['g++', '-o', 'main', 'main.cpp'] + links,
-            stdout = PIPE,
-            stderr = PIPE,
-            cwd = wd
-        )
-        out, err = proc.communicate()
-        status = proc.wait()
+        objects = [
+            compile_object(self.popen, self.communicate, 'g++',
+                quote + ['-include', header.path], main, wd)
+        ] + [
+            compile_object(self.popen, self.communicate, 'g++', [ ], path, wd)
+            for path in links
+        ]
+        
+        failed = [obj for obj in objects if obj.status != 0]
+        if len(failed) > 0:
+            messages = ''.join(obj.messages for obj in failed)
+            return [messages] + ([''] * (len(lines)-1))
+        
+        program = link_program(self.popen, self.communicate, 'g++', [ ],
+            objects, wd)
         
-        if status != 0:
-            return [out + err] + ([''] * (len(lines)-1))
+        if program.status != 0:
+            return [program.messages] + ([''] * (len(lines)-1))
         
-        proc = Popen(
-            ['./main'],
+        proc = self.popen(
+            [program.path],
             stdout = PIPE,
             stderr = STDOUT,
             cwd = wd
         )
-        out, err = proc.communicate()
+        chopper = Chopper(ids, lambda id: id,
+            self.context.output_limit, self.context.spill_dir)
+        self.communicate(proc, sink = chopper)
         # We can't rely on exit status here!
         
-        out_lines = [''] * len(lines)
-        try:
-            [_,rest] = out.split(ids[0])
-            for k in range(len(lines)):
-                [out_lines[k],rest] = rest.split(ids[k+1])
-        except:
-            # This basically means we got the wrong number of lines.
-            # Not much we can do. Give them what we can
-            out_lines[-1] = rest
-            pass
-        
-        return [l.rstrip().lstrip() for l in out_lines]
+        if chopper.current == None:
+            return [chopper.unchopped()]
+        return [l.rstrip().lstrip() for l in chopper.lines()]
     
     def highlight_lang(self):
         return 'cpp'
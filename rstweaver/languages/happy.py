@@ -1,9 +1,11 @@
 
 from rstweaver import WeaverLanguage
-from subprocess import Popen, PIPE, STDOUT
+from subprocess import PIPE, STDOUT
 
 class Happy(WeaverLanguage):
     
+    tracker = 'strace'
+    
     def __init__(self, **other_options):
         WeaverLanguage.__init__(self, {
             WeaverLanguage.noninteractive: 'happy'
@@ -12,14 +14,14 @@ class Happy(WeaverLanguage):
         )
     
     def run(self, path, wd):
-        runghc = Popen(
+        runghc = self.popen(
             ['happy', path],
             stdout = PIPE,
             stderr = PIPE,
             cwd = wd
         )
         
-        out, err = runghc.communicate()
+        out, err = self.communicate(runghc)
         
         return err + out
     
@@ -1,7 +1,9 @@
 
 from rstweaver import WeaverLanguage
-from subprocess import Popen, PIPE, STDOUT
+from rstweaver.buildcache import make_haskell
+from subprocess import PIPE, STDOUT
 import operator
+import os
 
 class Haskell(WeaverLanguage):
     
@@ -14,27 +16,31 @@ class Haskell(WeaverLanguage):
         )
     
     def test_compile(self, path, wd):
-        ghc = Popen(
-            ['ghc', '-c', '-o', '/dev/null', path],
-            stdout = PIPE,
-            stderr = PIPE,
-            cwd = wd
-        )
-        out, err = ghc.communicate()
+        built = self.build(path, wd, link=False)
         
-        return err
+        return built.messages
     
     def run(self, path, wd):
-        runghc = Popen(
-            ['runghc', path],
+        built = self.build(path, wd)
+        
+        if built.status != 0:
+            return built.messages
+        
+        proc = self.popen(
+            [built.path],
             stdout = PIPE,
             stderr = PIPE,
             cwd = wd
         )
         
-        out, err = runghc.communicate()
+        out, err = self.communicate(proc)
         
-        return err + out
+        return built.messages + err + out
+    
+    def build(self, path, wd, link=True):
+        # Modules are told apart by name, so each weaver dir keeps its own.
+        return make_haskell(self.popen, self.communicate, [ ], path, wd,
+            os.path.abspath(self.context.root_dir), link)
     
     def run_interactive(self, lines, imports, wd):
         return self.chopped_interactive(
@@ -47,7 +53,9 @@ class Haskell(WeaverLanguage):
             ], ''),
             lambda line: line,
             ['ghci', '-ignore-dot-ghci'],
-            wd
+            wd,
+            reset   = ':load\n',
+            imports = imports
         )
     
     def highlight_lang(self):
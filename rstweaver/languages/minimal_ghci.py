@@ -1,9 +1,15 @@
 
 from rstweaver import WeaverLanguage
-from subprocess import Popen, PIPE
+from rstweaver.utils import user_cache_dir, locked, fingerprint
+from rstweaver.chop import Chopper
+from subprocess import PIPE, STDOUT
+from uuid import uuid4
+import os
 
 class MinimalGHCI(WeaverLanguage):
     
+    tracker = 'strace'
+    
     def __init__(self, **other_options):
         WeaverLanguage.__init__(self, {
             WeaverLanguage.interactive:    'minghci'
@@ -12,21 +18,64 @@ class MinimalGHCI(WeaverLanguage):
         )
     
     def run_interactive(self, lines, imports, wd):
-        def do_line(line):
-            command = ['ghc'] + imports + ['-e', line]
-            
-            ghci = Popen(
+        outputs = [ ]
+        while len(outputs) < len(lines):
+            outputs += self.run_batch(lines[len(outputs):], imports, wd)
+        
+        return outputs
+    
+    def run_batch(self, lines, imports, wd):
+        '''
+        Run lines in a single ghc, one -e each, with a uuid printed after
+        each to tell where its output ends.
+        
+        If a line stops ghc, the lines after it don't run.
+        
+        Returns:
+            Outputs of the lines that ran (at least one), the last being the
+            error from the line that stopped ghc, if one did.
+        '''
+        ids = [uuid4().hex for j in range(len(lines)+1)]
+        
+        build = self.build_dir()
+        command = ['ghc', '-fobject-code', '-odir', build, '-hidir', build]
+        
+        # Loaded with *, the imports themselves are interpreted so that all
+        # their top-level names are in scope; what they import is compiled
+        # into the build dir, and reused from there next time.
+        if len(imports) > 0:
+            command += ['-e', ':load ' + ' '.join('*' + im for im in imports)]
+        
+        command += ['-e', 'putStrLn "%s"' % ids[0]]
+        for line, id in zip(lines, ids[1:]):
+            command += ['-e', line, '-e', 'putStrLn "%s"' % id]
+        
+        with locked(build + '/lock'):
+            ghc = self.popen(
                 command,
                 stdout = PIPE,
-                stderr = PIPE,
+                stderr = STDOUT,
                 cwd = wd
             )
             
-            out, err = ghci.communicate()
-
-            return err + out
+            chopper = Chopper(ids, lambda id: id + '\n',
+                self.context.output_limit, self.context.spill_dir)
+            self.communicate(ghc, sink = chopper)
+        
+        outputs = chopper.lines()
         
-        return [do_line(line) for line in lines]
+        if chopper.current == None:
+            # The imports didn't load.
+            return [chopper.unchopped()]
+        return outputs[:chopper.current + 1]
+    
+    def build_dir(self):
+        '''
+        Where compiled modules are kept between runs, one per weaver dir so
+        that same-named modules from other documents don't get mixed up.
+        '''
+        return user_cache_dir('minghci',
+            fingerprint(os.path.abspath(self.context.root_dir)))
     
     def highlight_lang(self):
         return 'haskell'
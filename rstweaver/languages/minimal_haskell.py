@@ -1,9 +1,13 @@
 
 from rstweaver import WeaverLanguage
-from subprocess import Popen, PIPE
+from rstweaver.buildcache import make_haskell
+from subprocess import PIPE
+import os
 
 class MinimalHaskell(WeaverLanguage):
     
+    tracker = 'strace'
+    
     def __init__(self, **other_options):
         WeaverLanguage.__init__(self, {
             WeaverLanguage.noninteractive: 'minhaskell'
@@ -12,27 +16,30 @@ class MinimalHaskell(WeaverLanguage):
         )
     
     def test_compile(self, path, wd):
-        ghc = Popen(
-            ['ghc', '-c', '-o', '/dev/null', path],
-            stdout = PIPE,
-            stderr = PIPE,
-            cwd = wd
-        )
-        out, err = ghc.communicate()
+        built = self.build(path, wd, link=False)
         
-        return err
+        return built.messages
     
     def run(self, path, wd):
-        runghc = Popen(
-            ['runghc', path],
+        built = self.build(path, wd)
+        
+        if built.status != 0:
+            return built.messages
+        
+        proc = self.popen(
+            [built.path],
             stdout = PIPE,
             stderr = PIPE,
             cwd = wd
         )
         
-        out, err = runghc.communicate()
+        out, err = self.communicate(proc)
         
-        return err + out
+        return built.messages + err + out
+    
+    def build(self, path, wd, link=True):
+        return make_haskell(self.popen, self.communicate, [ ], path, wd,
+            os.path.abspath(self.context.root_dir), link)
     
     def highlight_lang(self):
         return 'haskell'
@@ -1,10 +1,24 @@
 
 from rstweaver  import WeaverLanguage
-from subprocess import Popen, PIPE, STDOUT
+from rstweaver import forkserver
+from subprocess import PIPE, STDOUT
+import os
 import re
 from uuid import uuid4
 import operator
 
+# Puts a kept ipython back the way it started. %reset -f only clears the
+# namespace; modules imported from the working directory are dropped from
+# sys.modules too, so that the next session imports them again as they are
+# now (and is seen reading them) rather than getting the ones from before.
+reset = (
+      'import sys as _sys, os as _os; '
+    + '[_sys.modules.pop(_name) for _name, _module in list(_sys.modules.items()) '
+    + 'if _os.path.abspath(getattr(_module, "__file__", None) or _os.sep)'
+    + '.startswith(_os.getcwd() + _os.sep)];\n'
+    + '%reset -f\n'
+)
+
 class Python(WeaverLanguage):
     
     def __init__(self, **other_options):
@@ -15,30 +29,56 @@ class Python(WeaverLanguage):
         **other_options
         )
     
+    # Modules for the fork server to import before forking, so that blocks
+    # importing them don't each pay for it.
+    preimports = [name for name in
+        os.environ.get('RSTWEAVER_PYTHON_PREIMPORTS', '').split(',') if name]
+    
     def test_compile(self, path, wd):
-        proc = Popen(
-            ['python', path],
-            stdout = PIPE,
-            stderr = PIPE,
-            cwd = wd
-        )
+        proc = self.forked('compile', path, wd)
+        if proc == None:
+            proc = self.popen(
+                ['python', '-c',
+                    'import sys; compile(open(sys.argv[1]).read(), sys.argv[1], "exec")',
+                    path],
+                stdout = PIPE,
+                stderr = PIPE,
+                cwd = wd
+            )
         
-        out, err = proc.communicate()
+        out, err = self.communicate(proc)
         
         return err
     
     def run(self, path, wd):
-        proc = Popen(
-            ['python', path],
-            stdout = PIPE,
-            stderr = PIPE,
-            cwd = wd
-        )
+        proc = self.forked('run', path, wd)
+        if proc == None:
+            proc = self.popen(
+                ['python', path],
+                stdout = PIPE,
+                stderr = PIPE,
+                cwd = wd
+            )
         
-        out, err = proc.communicate()
+        out, err = self.communicate(proc)
         
         return err + out
     
+    def forked(self, mode, path, wd):
+        '''
+        Start path running (or compiling) in a child of the fork server, or
+        return None if there is no working server.
+        '''
+        server = forkserver.server(['python'], self.preimports)
+        if server == None:
+            return None
+        
+        try:
+            return server.start(mode, path, wd)
+        except forkserver.ServerGone:
+            forkserver.forget(['python'], self.preimports)
+            return None
+    
     def run_interactive(self, lines, imports, wd):
         return self.chopped_interactive(
             lines,
@@ -49,7 +89,9 @@ class Python(WeaverLanguage):
             ], ''),
             lambda line: line,
             ['ipython', '-quick', '-prompt_in1', '\n', '-prompt_out', '\n'],
-            wd
+            wd,
+            reset   = reset,
+            imports = imports
         )
     
     def highlight_lang(self):
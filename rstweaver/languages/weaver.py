@@ -3,11 +3,14 @@ from rstweaver import WeaverLanguage
 import docutils.core
 from docutils import nodes
 from docutils.parsers import rst
-from subprocess import Popen, PIPE
+from subprocess import PIPE
 import re
 
 class RstWeaverLanguage(WeaverLanguage):
     
+    # Running processes directives, which has to happen in order.
+    parallel = False
+    
     def __init__(self, **other_options):
         WeaverLanguage.__init__(self, {
             WeaverLanguage.noninteractive: 'weaver'
@@ -16,13 +19,13 @@ class RstWeaverLanguage(WeaverLanguage):
         )
     
     def test_compile(self, path, wd):
-        run = Popen(
+        run = self.popen(
             ['rstweave', '-o', '/dev/null', path],
             stdout = PIPE,
             stderr = PIPE,
             cwd = wd
         )
-        out, err = run.communicate()
+        out, err = self.communicate(run)
         
         return err
     
@@ -0,0 +1,193 @@
+
+'''
+Record the files a run opened, and those it looked for and didn't find, for
+the strace tracker (see trackers).
+
+treewatcher only hears about files that exist, so a run that failed because
+a file was missing (#include "not-exist.h") would be cached with no record
+of that file. Processes started through WeaverLanguage.popen() during a run
+of a language tracked with strace are traced, when strace is installed and
+allowed to work, and every open/stat/access inside the working directory
+that failed with ENOENT is reported, so the run can be redone once such a
+file appears.
+'''
+
+import os
+import re
+import shutil
+import threading
+from tempfile import mkdtemp
+from collections import namedtuple
+from subprocess import call
+from distutils.spawn import find_executable
+
+# pid syscall(args) = result [ERROR ...]. Lines may be split into
+# <unfinished ...> and <... resumed> halves when processes are traced with -f.
+call_pat    = re.compile(r'^(?:(\d+)\s+)?(\w+)\((.*)$')
+resumed_pat = re.compile(r'^(?:(\d+)\s+)?<\.\.\. (\w+) resumed>(.*)$')
+string_pat  = re.compile(r'"((?:[^"\\]|\\.)*)"')
+write_pat   = re.compile(r'O_WRONLY|O_RDWR|O_CREAT|O_TRUNC')
+
+open_calls   = ('open', 'openat', 'openat2', 'creat')
+exec_calls   = ('execve', 'execveat')
+rename_calls = ('rename', 'renameat', 'renameat2')
+
+# read: paths opened for reading (or run), written: opened for writing or
+# renamed to, absent: looked for and not found. All relative to wd.
+Trace = namedtuple('Trace', ['read', 'written', 'absent'])
+
+state = threading.local()
+usable = None
+
+# What strace is run with, once strace_usable() has looked.
+strace_command = None
+
+def strace_usable():
+    '''
+    Whether strace is installed and may trace here (it can't in some
+    containers). Checked once.
+    
+    Where strace has --seccomp-bpf (5.3 on), it is used, so that only the
+    file calls being traced stop the process rather than every call.
+    '''
+    global usable, strace_command
+    if usable == None:
+        strace = find_executable('strace')
+        usable = False
+        if strace != None:
+            for flags in (['--seccomp-bpf'], [ ]):
+                command = [strace, '-f', '-qq'] + flags + ['-e', 'trace=file']
+                if works(command):
+                    usable = True
+                    strace_command = command
+                    break
+    return usable
+
+def works(command):
+    with open(os.devnull, 'w') as null:
+        return call(
+            command + ['-o', os.devnull, 'true'],
+            stdout = null,
+            stderr = null
+        ) == 0
+
+def begin(wd):
+    '''
+    Start recording file accesses for the current thread's run in wd. Runs
+    may nest; each end() finishes the latest begin().
+    
+    Only the strace tracker (see trackers) does this; processes started
+    outside a begin() and end() aren't traced.
+    '''
+    if not hasattr(state, 'runs'):
+        state.runs = [ ]
+    
+    if strace_usable():
+        log_dir = mkdtemp(prefix='rstweaver-probes-')
+    else:
+        log_dir = None
+    state.runs.append([log_dir, os.path.abspath(wd), 0])
+
+def wrap(command):
+    '''
+    The command to actually run for command.
+    '''
+    runs = getattr(state, 'runs', None)
+    if not runs or runs[-1][0] == None:
+        return command
+    
+    run = runs[-1]
+    run[2] += 1
+    log = os.path.join(run[0], '%d.log' % run[2])
+    return strace_command + ['-o', log] + list(command)
+
+def end():
+    '''
+    Stop recording.
+    
+    Returns:
+        Trace of what processes started since begin() did in wd (all empty
+        if strace couldn't be used).
+    '''
+    log_dir, wd, count = state.runs.pop()
+    trace = Trace(set(), set(), set())
+    if log_dir == None:
+        return trace
+    
+    for name in os.listdir(log_dir):
+        with open(os.path.join(log_dir, name), 'r') as hl:
+            add_calls(trace, file_calls(hl), wd)
+    
+    shutil.rmtree(log_dir, True)
+    return trace
+
+def add_calls(trace, calls, wd):
+    for call, args, paths, result, error in calls:
+        if len(paths) == 0:
+            continue
+        
+        if result == '-1':
+            if error == 'ENOENT':
+                add_path(trace.absent, paths[0], wd)
+        elif call in open_calls:
+            if call == 'creat' or write_pat.search(args):
+                add_path(trace.written, paths[0], wd)
+            if call != 'creat' and 'O_WRONLY' not in args:
+                add_path(trace.read, paths[0], wd)
+        elif call in exec_calls:
+            add_path(trace.read, paths[0], wd)
+        elif call in rename_calls:
+            add_path(trace.written, paths[-1], wd)
+
+def add_path(paths, path, wd):
+    rel = relative_path(path, wd)
+    if rel != None:
+        paths.add(rel)
+
+def file_calls(lines):
+    '''
+    (syscall, argument text, quoted paths, result, error) for each call in
+    an strace log, with the halves of interrupted calls put back together.
+    error is None unless result is -1.
+    '''
+    unfinished = { }
+    for line in lines:
+        line = line.rstrip('\n')
+        
+        match = resumed_pat.match(line)
+        if match != None:
+            pid, call, rest = match.groups()
+            start = unfinished.pop(pid, None)
+            if start == None:
+                continue
+            text = start + rest
+        else:
+            match = call_pat.match(line)
+            if match == None:
+                # Signals, exits and the like.
+                continue
+            pid, call, text = match.groups()
+            if text.endswith('<unfinished ...>'):
+                unfinished[pid] = text[:-len('<unfinished ...>')]
+                continue
+        
+        end = text.rfind(') = ')
+        if end == -1:
+            continue
+        args = text[:end]
+        outcome = text[end+4:].split()
+        if len(outcome) == 0:
+            continue
+        
+        result = outcome[0]
+        error = outcome[1] if result == '-1' and len(outcome) > 1 else None
+        paths = [path.decode('string_escape') for path in string_pat.findall(args)]
+        
+        yield (call, args, paths, result, error)
+
+def relative_path(path, wd):
+    path = os.path.normpath(os.path.join(wd, path))
+    if not path.startswith(wd + os.sep):
+        return None
+    return os.path.relpath(path, wd)
+
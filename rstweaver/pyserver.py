@@ -0,0 +1,191 @@
+
+'''
+The server end of forkserver, run by the Python that blocks are run with
+(which may not be the one rstweaver runs on, so this has to work on Python 2
+and 3 alike, and must not import anything from rstweaver).
+
+Imports the modules named on the command line, then reads requests from
+stdin, one JSON object per line:
+    
+    {"mode": "run" or "compile", "path": ..., "wd": ...,
+     "out": ..., "err": ..., "cpu": ..., "memory": ...}
+
+and for each forks a child, which opens the FIFOs out and err as its stdout
+and stderr, moves to wd, and runs (or only compiles) path as `python path`
+would. Once the child has its output open, the server replies with its pid.
+
+As `python path` would means: path's directory comes first on sys.path, and
+modules imported ahead of time that it has a module of the same name for are
+forgotten, so the block's own is imported instead; and at the end, threads
+are waited for and atexit handlers run.
+'''
+
+import sys
+
+# The modules a fresh python has before running anything, which a block's
+# directory doesn't shadow for `python path` either.
+startup_modules = set(sys.modules)
+
+import os
+import json
+import types
+import atexit
+import signal
+import resource
+import traceback
+
+def main():
+    # This is where a block's own directory will go; this file's shouldn't
+    # be on the path meanwhile.
+    sys.path[0] = ''
+    
+    for name in sys.argv[1:]:
+        try:
+            __import__(name)
+        except Exception:
+            traceback.print_exc()
+    
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        request = json.loads(line)
+        
+        ready_read, ready_write = os.pipe()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_read)
+            child(request, ready_write)
+        
+        os.close(ready_write)
+        os.read(ready_read, 1)
+        os.close(ready_read)
+        
+        sys.stdout.write('%d\n' % pid)
+        sys.stdout.flush()
+
+def child(request, ready):
+    status = 1
+    try:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        os.setsid()
+        
+        if request.get('cpu') != None:
+            cpu = int(request['cpu'])
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu))
+        if request.get('memory') != None:
+            memory = int(request['memory'])
+            resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+        
+        out = os.open(request['out'], os.O_WRONLY)
+        err = os.open(request['err'], os.O_WRONLY)
+        os.write(ready, b'.')
+        os.close(ready)
+        
+        null = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(null, 0)
+        os.dup2(out, 1)
+        os.dup2(err, 2)
+        for fd in (null, out, err):
+            os.close(fd)
+        sys.stdin = open(os.devnull, 'r')
+        
+        os.chdir(request['wd'])
+        status = execute(request['mode'], request['path'])
+        shut_down()
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(status)
+
+def execute(mode, path):
+    with open(path, 'rb') as hl:
+        source = hl.read()
+    
+    try:
+        code = compile(source, path, 'exec')
+    except SyntaxError:
+        kind, value = sys.exc_info()[:2]
+        traceback.print_exception(kind, value, None)
+        return 1
+    
+    if mode == 'compile':
+        return 0
+    
+    main = types.ModuleType('__main__')
+    main.__file__ = path
+    sys.modules['__main__'] = main
+    sys.argv = [path]
+    dir = os.path.dirname(os.path.abspath(path))
+    sys.path[0] = dir
+    forget_shadowed(dir)
+    
+    try:
+        exec(code, main.__dict__)
+    except SystemExit:
+        return exit_status(sys.exc_info()[1].code)
+    except BaseException:
+        kind, value, tb = sys.exc_info()
+        # Leave out this frame, as python would have no frame of ours.
+        traceback.print_exception(kind, value, tb.tb_next)
+        return 1
+    
+    return 0
+
+def forget_shadowed(dir):
+    '''
+    Drop the modules imported ahead of time (and their submodules) that a
+    module in dir would have been imported as instead.
+    '''
+    for name in list(sys.modules):
+        top = name.split('.')[0]
+        if top in startup_modules or not shadowed(dir, top):
+            continue
+        
+        module = sys.modules[name]
+        file = getattr(module, '__file__', None)
+        if file != None and os.path.abspath(file).startswith(dir + os.sep):
+            continue
+        del sys.modules[name]
+
+def shadowed(dir, name):
+    return (os.path.exists(os.path.join(dir, name + '.py'))
+        or os.path.exists(os.path.join(dir, name, '__init__.py')))
+
+def shut_down():
+    '''
+    What python does on the way out, which os._exit() skips: wait for the
+    threads that aren't daemons, then run the atexit handlers.
+    '''
+    threading = sys.modules.get('threading')
+    if threading != None:
+        threading._shutdown()
+    
+    if hasattr(sys, 'exitfunc'):
+        # Python 2, where atexit (or the program) sets sys.exitfunc.
+        exitfunc = sys.exitfunc
+        del sys.exitfunc
+        exitfunc()
+    elif hasattr(atexit, '_run_exitfuncs'):
+        atexit._run_exitfuncs()
+
+def exit_status(code):
+    if code == None:
+        return 0
+    if isinstance(code, int):
+        return code
+    sys.stderr.write('%s\n' % (code,))
+    return 1
+
+if __name__ == '__main__':
+    main()
+
@@ -0,0 +1,45 @@
+
+'''
+Highlighted code written straight to HTML, for when the document is going to
+the HTML writer.
+
+A long listing is otherwise tens of thousands of inline nodes (one per token,
+and more once lines are numbered), each visited by the writer. Here the whole
+listing is written in one go as the same markup the writer would have made
+from those nodes (a <pre> with a <span> per token), so the CSS applies all the
+same, and handed to the writer as a single raw node.
+
+Tokens are (CSS class or None, text), as from highlight.highlight_tokens.
+'''
+
+from docutils import nodes
+
+html_writers = ('html', 'html4', 'html4css1', 'html5', 'xhtml')
+
+def escape(text):
+    return (text
+        .replace('&', '&amp;')
+        .replace('<', '&lt;')
+        .replace('>', '&gt;')
+        .replace('"', '&quot;'))
+
+def span(css_class, text):
+    # No class ('' as well as None) is plain text, as in token_nodes.
+    if not css_class:
+        return escape(text)
+    return wrap(css_class, escape(text))
+
+def wrap(css_class, html):
+    return '<span class="%s">%s</span>' % (css_class, html)
+
+def tokens_html(tokens):
+    return ''.join(span(css_class, text) for css_class, text in tokens if text)
+
+def literal_block(classes, body):
+    '''
+    A raw node for a literal_block with classes, holding body (HTML).
+    '''
+    html = '<pre class="%s">%s</pre>\n' % (
+        ' '.join(['literal-block'] + classes), body)
+    return nodes.raw('', html, format='html')
+
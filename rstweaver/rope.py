@@ -0,0 +1,381 @@
+
+'''
+Persistent sequences of Blocks, for Block.subblocks.
+
+A Rope is a balanced (AVL) tree that is never modified: appending, inserting
+or replacing a block makes a new Rope sharing all but O(log n) nodes with the
+old one. Each node caches the line count, text length and hash of its whole
+subtree, so none of those ever has to walk the blocks.
+
+Blocks sit under keys that say where they are in the sequence and never
+change once given out, so a key found once keeps pointing at the same slot
+however much is inserted around it.
+
+The hash is a polynomial one over the blocks' digests, so it depends only on
+the sequence of blocks and not on how the tree happens to be balanced.
+
+The same tree, without the cached totals, also makes Map, a persistent
+dictionary (File's index of block names).
+'''
+
+from fractions import Fraction
+
+# Hashes are computed modulo the Mersenne prime 2**127 - 1.
+modulus = 2**127 - 1
+base    = 0x5bd1e9955bd1e9955bd1e9955bd1e995
+
+class Node(object):
+    
+    __slots__ = ('key', 'block', 'left', 'right',
+        'height', 'size', 'lines', 'length', 'hash', 'power')
+    
+    def __init__(self, key, block, left, right):
+        self.key   = key
+        self.block = block
+        self.left  = left
+        self.right = right
+        
+        self.height = 1 + max(height(left), height(right))
+        self.size   = size(left) + 1 + size(right)
+        self.lines  = lines(left) + block.count_lines() + lines(right)
+        self.length = length(left) + block.lines_length() + length(right)
+        
+        left_hash, left_power   = hash_power(left)
+        right_hash, right_power = hash_power(right)
+        own = int(block.digest(), 16) % modulus
+        
+        self.hash  = ((left_hash * base + own) * right_power + right_hash) % modulus
+        self.power = (left_power * base * right_power) % modulus
+
+class MapNode(object):
+    '''
+    A node of a Map, holding a value (under the same name Node uses, so that
+    the balancing below works on either).
+    '''
+    
+    __slots__ = ('key', 'block', 'left', 'right', 'height')
+    
+    def __init__(self, key, block, left, right):
+        self.key   = key
+        self.block = block
+        self.left  = left
+        self.right = right
+        
+        self.height = 1 + max(height(left), height(right))
+
+def height(node): return 0 if node is None else node.height
+def size(node):   return 0 if node is None else node.size
+def lines(node):  return 0 if node is None else node.lines
+def length(node): return 0 if node is None else node.length
+
+def hash_power(node):
+    if node is None:
+        return (0, 1)
+    return (node.hash, node.power)
+
+def make(key, block, left, right, cls=Node):
+    '''
+    A node (of class cls) with these contents, rotated if need be to stay
+    balanced. left and right may differ in height by at most two.
+    '''
+    if height(left) > height(right) + 1:
+        if height(left.left) >= height(left.right):
+            return cls(left.key, left.block, left.left,
+                cls(key, block, left.right, right))
+        else:
+            middle = left.right
+            return cls(middle.key, middle.block,
+                cls(left.key, left.block, left.left, middle.left),
+                cls(key, block, middle.right, right))
+    
+    if height(right) > height(left) + 1:
+        if height(right.right) >= height(right.left):
+            return cls(right.key, right.block,
+                cls(key, block, left, right.left), right.right)
+        else:
+            middle = right.left
+            return cls(middle.key, middle.block,
+                cls(key, block, left, middle.left),
+                cls(right.key, right.block, middle.right, right.right))
+    
+    return cls(key, block, left, right)
+
+def insert(node, key, block, cls=Node):
+    '''
+    Put block under key, replacing whatever was there.
+    '''
+    if node is None:
+        return cls(key, block, None, None)
+    if key < node.key:
+        return make(node.key, node.block,
+            insert(node.left, key, block, cls), node.right, cls)
+    if key > node.key:
+        return make(node.key, node.block,
+            node.left, insert(node.right, key, block, cls), cls)
+    return cls(key, block, node.left, node.right)
+
+def remove(node, key, cls):
+    '''
+    Take out whatever is under key, if anything.
+    '''
+    if node is None:
+        return None
+    if key < node.key:
+        return make(node.key, node.block, remove(node.left, key, cls), node.right, cls)
+    if key > node.key:
+        return make(node.key, node.block, node.left, remove(node.right, key, cls), cls)
+    
+    if node.left is None:
+        return node.right
+    if node.right is None:
+        return node.left
+    first_key, first_block, right = remove_first(node.right, cls)
+    return make(first_key, first_block, node.left, right, cls)
+
+def remove_first(node, cls):
+    '''
+    (key, block, rest) for the first node under node.
+    '''
+    if node.left is None:
+        return (node.key, node.block, node.right)
+    key, block, left = remove_first(node.left, cls)
+    return (key, block, make(node.key, node.block, left, node.right, cls))
+
+def build(items, start, end, cls=Node):
+    if start >= end:
+        return None
+    middle = (start + end) // 2
+    key, block = items[middle]
+    return cls(key, block,
+        build(items, start, middle, cls), build(items, middle+1, end, cls))
+
+class Rope(object):
+    
+    def __init__(self, root=None):
+        self.root = root
+    
+    @staticmethod
+    def of(blocks):
+        '''
+        A Rope holding blocks, in order.
+        '''
+        items = [(k+1, block) for k, block in enumerate(blocks)]
+        return Rope(build(items, 0, len(items)))
+    
+    def __len__(self):
+        return size(self.root)
+    
+    def __iter__(self):
+        for key, block in self.items():
+            yield block
+    
+    def __reversed__(self):
+        for key, block in self.reversed_items():
+            yield block
+    
+    def items(self):
+        '''
+        (key, block) pairs, in order.
+        '''
+        stack = [ ]
+        node = self.root
+        while stack or node is not None:
+            if node is not None:
+                stack.append(node)
+                node = node.left
+            else:
+                node = stack.pop()
+                yield (node.key, node.block)
+                node = node.right
+    
+    def reversed_items(self):
+        stack = [ ]
+        node = self.root
+        while stack or node is not None:
+            if node is not None:
+                stack.append(node)
+                node = node.right
+            else:
+                node = stack.pop()
+                yield (node.key, node.block)
+                node = node.left
+    
+    def get(self, key):
+        node = self.root
+        while node is not None:
+            if key < node.key:
+                node = node.left
+            elif key > node.key:
+                node = node.right
+            else:
+                return node.block
+        return None
+    
+    def first_key(self):
+        node = self.root
+        if node is None:
+            return None
+        while node.left is not None:
+            node = node.left
+        return node.key
+    
+    def last_key(self):
+        node = self.root
+        if node is None:
+            return None
+        while node.right is not None:
+            node = node.right
+        return node.key
+    
+    def key_after(self, key):
+        '''
+        The smallest key greater than key, or None.
+        '''
+        found = None
+        node = self.root
+        while node is not None:
+            if node.key > key:
+                found = node.key
+                node = node.left
+            else:
+                node = node.right
+        return found
+    
+    def append_key(self):
+        '''
+        A key that would come after all the others.
+        '''
+        last = self.last_key()
+        return 1 if last is None else last + 1
+    
+    def prepend_key(self):
+        first = self.first_key()
+        return 1 if first is None else first - 1
+    
+    def insert_key(self, key):
+        '''
+        A key that would come right after key.
+        '''
+        following = self.key_after(key)
+        if following is None:
+            return key + 1
+        return (key + following) / Fraction(2)
+    
+    def append(self, block):
+        return self.replace(self.append_key(), block)
+    
+    def prepend(self, block):
+        return self.replace(self.prepend_key(), block)
+    
+    def insert_after(self, key, block):
+        '''
+        Insert block right after the block under key.
+        '''
+        return self.replace(self.insert_key(key), block)
+    
+    def replace(self, key, block):
+        '''
+        Put block under key, whether or not there was one there.
+        '''
+        return Rope(insert(self.root, key, block))
+    
+    def count_lines(self):
+        return lines(self.root)
+    
+    def lines_length(self):
+        return length(self.root)
+    
+    def digest(self):
+        '''
+        Hex digest of the blocks in order (independent of tree shape).
+        '''
+        node_hash, power = hash_power(self.root)
+        return '%x:%d' % (node_hash, size(self.root))
+    
+    def __eq__(self, other):
+        if not isinstance(other, Rope):
+            return False
+        return self.digest() == other.digest() and list(self) == list(other)
+    
+    def __ne__(self, other):
+        return not self.__eq__(other)
+    
+    def __hash__(self):
+        return hash(self.digest())
+    
+    def __getstate__(self):
+        return list(self.items())
+    
+    def __setstate__(self, items):
+        self.root = build(items, 0, len(items))
+    
+    def __repr__(self):
+        return 'Rope(%r)' % (list(self),)
+
+empty = Rope()
+
+class Map(object):
+    '''
+    A dictionary that is never modified: set() and remove() make a new Map
+    sharing all but O(log n) nodes with the old one.
+    '''
+    
+    def __init__(self, root=None):
+        self.root = root
+    
+    def get(self, key, default=None):
+        node = self.root
+        while node is not None:
+            if key < node.key:
+                node = node.left
+            elif key > node.key:
+                node = node.right
+            else:
+                return node.block
+        return default
+    
+    def __contains__(self, key):
+        return self.get(key, missing) is not missing
+    
+    def set(self, key, value):
+        return Map(insert(self.root, key, value, MapNode))
+    
+    def remove(self, key):
+        return Map(remove(self.root, key, MapNode))
+    
+    def items(self):
+        stack = [ ]
+        node = self.root
+        while stack or node is not None:
+            if node is not None:
+                stack.append(node)
+                node = node.left
+            else:
+                node = stack.pop()
+                yield (node.key, node.block)
+                node = node.right
+    
+    def __len__(self):
+        return sum(1 for item in self.items())
+    
+    def __eq__(self, other):
+        if not isinstance(other, Map):
+            return False
+        return list(self.items()) == list(other.items())
+    
+    def __ne__(self, other):
+        return not self.__eq__(other)
+    
+    def __getstate__(self):
+        return list(self.items())
+    
+    def __setstate__(self, items):
+        self.root = build(items, 0, len(items), MapNode)
+    
+    def __repr__(self):
+        return 'Map(%r)' % (list(self.items()),)
+
+missing = object()
+
+empty_map = Map()
+
@@ -1,11 +1,15 @@
 
-from docutils.core import publish_parts, publish_string
+from docutils.core import publish_parts, publish_string, publish_doctree
 from docutils.parsers.rst import directives
 from docutils.parsers import rst
 
 from context import get_weaver_context, WeaverContext
 from languages import all_languages
 from css import structure_css
+from db import default_budget
+from shared import default_budget as default_shared_budget
+from capture import default_output_limit
+from supervise import default_limits
 
 weaver_languages = [ ]
 
@@ -37,7 +41,10 @@ def register_all_languages():
     for lang in all_languages:
         register_weaver_language(lang)
 
-def rst_to_doc(source, languages, wd=None, css=True, full=False, output_format='html'):
+def rst_to_doc(source, languages, wd=None, css=True, full=False, output_format='html',
+        cache_budget=default_budget, debug_keys=False, shared_cache=None,
+        shared_cache_budget=default_shared_budget, jobs=1,
+        output_limit=default_output_limit, limits=default_limits):
     '''
     Convert the reST input source to the output format.
     
@@ -50,17 +57,39 @@ def rst_to_doc(source, languages, wd=None, css=True, full=False, output_format='
         css           -- Include <style> tags
         full          -- Include <html>, <body> etc
         output_format -- passed to publish_parts as writer_name
+        cache_budget  -- Bytes of cached runs to keep in wd
+        debug_keys    -- Also store each directive's full cache key
+        shared_cache  -- Directory or URL of a cache shared between builds
+        shared_cache_budget -- Bytes the shared cache may take up, if it's a
+                         directory (None for no limit)
+        jobs          -- How many programs to run at once
+        output_limit  -- Bytes of each program's output to show
+        limits        -- supervise.Limits on each program run
     
     Returns:
         HTML as a string
     '''
     context = WeaverContext(
         wd = wd,
-        languages = languages
+        languages = languages,
+        cache_budget = cache_budget,
+        debug_keys = debug_keys,
+        shared_cache = shared_cache,
+        shared_cache_budget = shared_cache_budget,
+        output_limit = output_limit,
+        limits = limits,
+        output_format = output_format
     )
     parser = rst.Parser(
         run_directives = context.directive_dict()
     )
+    
+    if jobs > 1:
+        # Read the document once just to find what needs running, run it
+        # all in parallel, then read it for real using those results.
+        context.fsm.begin_plan()
+        publish_doctree(source, parser = parser)
+        context.fsm.end_plan(jobs)
  
     if output_format == 'html' and (css or not full):
         parts = publish_parts(
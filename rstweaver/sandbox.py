@@ -0,0 +1,123 @@
+
+'''
+Directories for runs to happen in.
+
+A run used to happen in the weaver dir itself, alongside the cache and
+whatever earlier runs had left there, and everything it read or wrote was
+put down to it. Now each run gets a Sandbox holding only the files being
+built, as copies of those in the weaver dir, so it sees nothing else and
+only its own doings are watched. What it writes is copied back afterwards,
+in order of path.
+
+They are copies rather than hard links: a run writing to a file in place
+would otherwise change it in the weaver dir, and in every other sandbox
+linked to it, behind rstweaver's back.
+
+Sandboxes are kept and refilled rather than made anew, so a run finds the
+same directory each time (interpreters kept running in one, see sessions,
+can be used again), and files that haven't changed aren't copied again:
+each copy is known by the digest the FileSet had for it, and one a run wrote
+to is copied afresh next time.
+'''
+
+import os
+import shutil
+import threading
+from tempfile import mkstemp
+from utils import makepdir
+
+class Sandbox(object):
+    
+    def __init__(self, path):
+        self.path = path
+        # The digest of the File each copy was made from.
+        self.copies = { }
+        makepdir(path)
+    
+    def fill(self, files, source):
+        '''
+        Make the sandbox hold exactly files (a FileSet's, by name), as they
+        are in the directory source, which has to match them.
+        '''
+        wanted = set(files)
+        
+        for dir, subdirs, names in os.walk(self.path, topdown=False):
+            for name in names:
+                full = os.path.join(dir, name)
+                rel  = os.path.relpath(full, self.path)
+                if not (rel in wanted
+                        and self.copies.get(rel) == files[rel].digest()):
+                    os.remove(full)
+                    self.copies.pop(rel, None)
+            for name in subdirs:
+                full = os.path.join(dir, name)
+                if os.path.islink(full):
+                    os.remove(full)
+                else:
+                    try:
+                        os.rmdir(full)
+                    except OSError:
+                        pass
+        
+        for rel in sorted(wanted):
+            full = os.path.join(self.path, rel)
+            if os.path.lexists(full):
+                continue
+            
+            original = os.path.join(source, rel)
+            if not os.path.exists(original):
+                continue
+            
+            makepdir(os.path.dirname(full))
+            shutil.copy2(original, full)
+            self.copies[rel] = files[rel].digest()
+    
+    def merge(self, paths, dest):
+        '''
+        Copy paths (written by a run) back into the directory dest.
+        '''
+        for rel in sorted(paths):
+            full   = os.path.join(self.path, rel)
+            target = os.path.join(dest, rel)
+            # Its File will change once what was written is read back in.
+            self.copies.pop(rel, None)
+            
+            if not os.path.isfile(full):
+                continue
+            
+            makepdir(os.path.dirname(target))
+            fd, temp = mkstemp(dir=os.path.dirname(target))
+            os.close(fd)
+            shutil.copy2(full, temp)
+            os.rename(temp, target)
+    
+    def remove(self):
+        shutil.rmtree(self.path, True)
+
+class SandboxPool(object):
+    '''
+    Sandboxes under root, handed out one per run in progress (runs can
+    nest, when a run processes directives of its own).
+    '''
+    
+    def __init__(self, root):
+        self.root  = root
+        self.free  = [ ]
+        self.made  = 0
+        self.lock  = threading.Lock()
+    
+    def take(self):
+        with self.lock:
+            if self.free:
+                return self.free.pop()
+            self.made += 1
+            number = self.made
+        return Sandbox(os.path.join(self.root, str(number)))
+    
+    def give(self, sandbox):
+        with self.lock:
+            self.free.append(sandbox)
+    
+    def remove(self):
+        shutil.rmtree(self.root, True)
+
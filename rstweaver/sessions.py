@@ -0,0 +1,153 @@
+
+'''
+Interpreters kept running between interactive directives.
+
+Starting ghci or ipython (and loading everything they import) can take far
+longer than the directive itself. A Session is a live interpreter; once a
+directive is done with it, it goes back in the pool under its command,
+working directory and preamble, and the next directive with the same ones
+picks it up instead of starting another. A session is thrown away if any of
+the files it imported has changed since it started.
+'''
+
+import os
+import signal
+import threading
+import atexit
+from subprocess import Popen, PIPE, STDOUT
+
+class Session(object):
+    
+    def __init__(self, command, wd, stamp):
+        # Output has to come out as soon as it is written, not when the pipe
+        # closes; Python at least needs telling. Nor should it leave .pyc
+        # files around in wd.
+        env = dict(os.environ)
+        env['PYTHONUNBUFFERED'] = '1'
+        env['PYTHONDONTWRITEBYTECODE'] = '1'
+        
+        self.proc = Popen(
+            command,
+            stdin  = PIPE,
+            stdout = PIPE,
+            stderr = STDOUT,
+            cwd = wd,
+            env = env,
+            preexec_fn = os.setsid
+        )
+        self.stamp = stamp
+    
+    def alive(self):
+        return self.proc.poll() == None
+    
+    def exchange(self, input, chopper):
+        '''
+        Send input, and pass the output to chopper (a chop.Chopper) until it
+        has seen the end of the session, or the interpreter goes away.
+        
+        Input is written from another thread, since the interpreter may
+        produce more output than the pipe holds before it has read it all.
+        
+        Once a line has printed more than the chopper keeps of it (see
+        capture), the interpreter is killed rather than read from forever.
+        '''
+        writer = threading.Thread(target=self.write, args=(input,))
+        writer.daemon = True
+        writer.start()
+        
+        fd = self.proc.stdout.fileno()
+        while not chopper.finished:
+            chunk = os.read(fd, 65536)
+            if chunk == '':
+                break
+            chopper.feed(chunk)
+            if chopper.overflowed():
+                self.kill()
+                break
+        
+        writer.join()
+    
+    def write(self, input):
+        try:
+            self.proc.stdin.write(input)
+            self.proc.stdin.flush()
+        except IOError:
+            pass
+    
+    def kill(self):
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+    
+    def close(self):
+        if self.alive():
+            try:
+                self.proc.stdin.close()
+            except IOError:
+                pass
+            self.kill()
+        self.proc.wait()
+
+class SessionPool(object):
+    
+    def __init__(self):
+        self.sessions = { }
+        self.lock = threading.Lock()
+    
+    def take(self, key, stamp):
+        '''
+        An idle session for key started with the same import stamp, or None.
+        key is (command, wd, preamble).
+        '''
+        with self.lock:
+            idle = self.sessions.get(key, [ ])
+            while idle:
+                session = idle.pop()
+                if session.alive() and session.stamp == stamp:
+                    return session
+                session.close()
+        return None
+    
+    def give(self, key, session):
+        '''
+        Return a session once it is done with.
+        '''
+        if not session.alive():
+            session.close()
+            return
+        with self.lock:
+            self.sessions.setdefault(key, [ ]).append(session)
+    
+    def close_in(self, wd):
+        '''
+        Close the sessions running in wd (which is about to go away).
+        '''
+        with self.lock:
+            for key in [k for k in self.sessions if k[1] == wd]:
+                for session in self.sessions.pop(key):
+                    session.close()
+    
+    def close_all(self):
+        with self.lock:
+            for idle in self.sessions.values():
+                for session in idle:
+                    session.close()
+            self.sessions = { }
+
+def import_stamp(wd, imports):
+    '''
+    Something that changes whenever one of the imported files does.
+    '''
+    stamp = [ ]
+    for path in imports:
+        try:
+            st = os.stat(os.path.join(wd, path))
+            stamp.append((path, st.st_mtime, st.st_size))
+        except OSError:
+            stamp.append((path, None, None))
+    return tuple(stamp)
+
+pool = SessionPool()
+atexit.register(pool.close_all)
+
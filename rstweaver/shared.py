@@ -0,0 +1,215 @@
+
+'''
+A cache of runs shared between documents and machines.
+
+Entries are filed under the directive's fingerprint (the same key the local
+ActionCache uses) and then under a digest of the inputs the run saw, so
+identical blocks anywhere reuse one another's results.
+
+There are two stores: a directory, and anything speaking this HTTP protocol:
+    
+    GET /<key>/         names of the entries for <key>, one per line
+    GET /<key>/<entry>  a pickled (Action, cost)
+    PUT /<key>/<entry>  store one
+
+Running this module serves a directory store that way:
+    
+    python -m rstweaver.shared DIR [PORT [MEGABYTES]]
+
+A directory store keeps to a budget (a gigabyte unless told otherwise),
+deleting the least recently used keys when it goes over.
+
+Entries are pickles, so only share a cache with machines you trust.
+'''
+
+import os
+import sys
+import atexit
+import urllib2
+import cPickle as pickle
+from tempfile import mkstemp
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from utils import makepdir, fingerprint, used, trim_cache
+
+default_budget = 1024 * 1024 * 1024
+
+def open_shared_cache(location, budget=default_budget):
+    '''
+    Open a shared cache given a directory path or an http(s) URL.
+    
+    Parameters:
+        budget -- Bytes a directory may take up (None for no limit); an
+          HTTP server keeps to its own.
+    '''
+    if location.startswith('http://') or location.startswith('https://'):
+        return SharedCache(HTTPStore(location))
+    else:
+        return SharedCache(DirectoryStore(location, budget))
+
+class SharedCache(object):
+    
+    def __init__(self, store):
+        self.store = store
+    
+    def lookup(self, key, up_to_date):
+        '''
+        Find an action for key whose inputs up_to_date() accepts.
+        
+        Returns:
+            (action, cost), or None.
+        '''
+        try:
+            for entry in self.store.entries(key):
+                data = self.store.get(key, entry)
+                if data == None:
+                    continue
+                
+                action, cost = pickle.loads(data)
+                if up_to_date(action.inputs):
+                    return (action, cost)
+        except (EnvironmentError, pickle.UnpicklingError) as e:
+            print('Warning, shared cache lookup failed: %s' % str(e))
+        
+        return None
+    
+    def store_action(self, key, action, cost):
+        data = pickle.dumps((action, cost), pickle.HIGHEST_PROTOCOL)
+        try:
+            self.store.put(key, fingerprint(action.inputs), data)
+        except EnvironmentError as e:
+            print('Warning, shared cache store failed: %s' % str(e))
+
+class DirectoryStore(object):
+    
+    # Puts between trims, which walk the whole directory.
+    trim_every = 256
+    
+    def __init__(self, root, budget=default_budget):
+        self.root   = root
+        self.budget = budget
+        self.puts   = 0
+        atexit.register(self.trim)
+    
+    def trim(self):
+        if self.budget != None and self.puts > 0:
+            trim_cache([self.root], self.budget)
+            self.puts = 0
+    
+    def key_dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+    
+    def entries(self, key):
+        path = self.key_dir(key)
+        if not os.path.isdir(path):
+            return [ ]
+        return sorted(name for name in os.listdir(path)
+            if not name.startswith('.'))
+    
+    def get(self, key, entry):
+        try:
+            with open(os.path.join(self.key_dir(key), entry), 'rb') as hl:
+                data = hl.read()
+        except IOError:
+            return None
+        used(self.key_dir(key))
+        return data
+    
+    def put(self, key, entry, data):
+        path = self.key_dir(key)
+        makepdir(path)
+        
+        # Write then rename, so readers never see half an entry.
+        fd, temp = mkstemp(dir=path, prefix='.')
+        with os.fdopen(fd, 'wb') as hl:
+            hl.write(data)
+        os.chmod(temp, 0o644)
+        os.rename(temp, os.path.join(path, entry))
+        
+        self.puts += 1
+        if self.puts >= self.trim_every:
+            self.trim()
+
+class HTTPStore(object):
+    
+    def __init__(self, url, timeout=10):
+        self.url     = url.rstrip('/')
+        self.timeout = timeout
+    
+    def request(self, path, data=None):
+        request = urllib2.Request(self.url + path, data)
+        if data != None:
+            request.get_method = lambda: 'PUT'
+            request.add_header('Content-Type', 'application/octet-stream')
+        try:
+            return urllib2.urlopen(request, timeout=self.timeout).read()
+        except urllib2.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+    
+    def entries(self, key):
+        listing = self.request('/%s/' % key)
+        if listing == None:
+            return [ ]
+        return [line for line in listing.split('\n') if line != '']
+    
+    def get(self, key, entry):
+        return self.request('/%s/%s' % (key, entry))
+    
+    def put(self, key, entry, data):
+        self.request('/%s/%s' % (key, entry), data)
+
+class StoreRequestHandler(BaseHTTPRequestHandler):
+    '''
+    Serves self.server.store over the protocol described above.
+    '''
+    
+    def parts(self):
+        parts = self.path.strip('/').split('/')
+        for part in parts:
+            if part == '' or part.startswith('.') or not part.isalnum():
+                return None
+        return parts
+    
+    def reply(self, code, body=''):
+        self.send_response(code)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def do_GET(self):
+        store = self.server.store
+        parts = self.parts()
+        
+        if parts != None and len(parts) == 1:
+            entries = store.entries(parts[0])
+            self.reply(200, ''.join(entry + '\n' for entry in entries))
+        elif parts != None and len(parts) == 2:
+            data = store.get(parts[0], parts[1])
+            if data == None:
+                self.reply(404)
+            else:
+                self.reply(200, data)
+        else:
+            self.reply(404)
+    
+    def do_PUT(self):
+        parts = self.parts()
+        if parts == None or len(parts) != 2:
+            self.reply(400)
+            return
+        
+        length = int(self.headers.getheader('Content-Length', 0))
+        self.server.store.put(parts[0], parts[1], self.rfile.read(length))
+        self.reply(201)
+
+def serve(root, port=8642, budget=default_budget):
+    server = HTTPServer(('', port), StoreRequestHandler)
+    server.store = DirectoryStore(root, budget)
+    server.serve_forever()
+
+if __name__ == '__main__':
+    args = sys.argv[2:4]
+    serve(sys.argv[1], *([int(arg) for arg in args[:1]]
+        + [int(float(arg) * 1024 * 1024) for arg in args[1:]]))
+
@@ -1,10 +1,25 @@
 
-import operator
 import db
+import sessions
 from db import ActionCache, Action
-from treewatcher import run_watch_files
+from shared import open_shared_cache
+from trackers import tracked_run, sees_absent
+from utils import fingerprint
+from rope import Rope
+from sandbox import SandboxPool
+from supervise import limited
+import rope
 from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+from tempfile import mkdtemp
+from utils import makepdir, listdir
 import os
+import re
+import time
+import shutil
+import atexit
+import traceback
+import cPickle as pickle
 
 class FileSetManager(object):
     
@@ -12,29 +27,64 @@ class FileSetManager(object):
         self.context = context
         
         self.db = db.make_db(
-            context.root_dir + '/cache'
+            context.root_dir + '/cache.sqlite'
         )
         
-        if 'actions' not in self.db:
-            self.db['actions'] = ActionCache()
-            
-        self.actions = self.db['actions']
+        self.actions = ActionCache(self.db, context.cache_budget)
+        
+        if context.shared_cache != None:
+            self.shared = open_shared_cache(context.shared_cache,
+                context.shared_cache_budget)
+        else:
+            self.shared = None
         self.file_set = FileSet()
         self.watches = [ ]
+        
+        self.sandboxes = SandboxPool(context.root_dir + '/.runs')
+        atexit.register(self.sandboxes.remove)
+        
+        # Spill files (see capture) left by earlier builds; those none of
+        # this build's outputs mention are deleted at the end.
+        self.old_spills = set(
+            name for name in listdir(context.spill_dir) if name.endswith('.out'))
+        self.kept_spills = set()
+        atexit.register(self.remove_spills)
+        
+        self.planning = False
+        self.jobs     = [ ]
+        self.prepared = { }
     
-    def run_cache(self, key, producer):
+    def run_cache(self, key, producer, full_key=None):
+        if not self.context.debug_keys:
+            full_key = None
+        
         for action in self.actions[key]:
             if self.file_set.all_up_to_date(action.inputs):
                 self.file_set.apply_outputs(action.outputs)
+                self.actions.touch(key, action)
                 print('reusing')
-                return action.output
+                return self.keep_spills(action.output)
+        
+        if self.shared != None:
+            found = self.shared.lookup(key, self.file_set.all_up_to_date)
+            if found != None:
+                action, cost = found
+                self.file_set.apply_outputs(action.outputs)
+                self.actions.add(key, action, cost, full_key)
+                print('reusing shared')
+                return self.keep_spills(action.output)
         
         print('generating')
         
         watch = self.add_watch()
+        start = time.time()
         output = producer()
+        cost = time.time() - start + watch.extra_cost
         self.end_watch(watch)
         
+        if self.planning:
+            return output
+        
         for path in watch.outputs_external:
             full_path = self.context.wd + '/' + path
             try:
@@ -51,15 +101,33 @@ class FileSetManager(object):
             old_content = file.text()
             
             if content != None and (old_content != content):
-                self.file_set.files[path] = File.binary(path, content)
+                self.file_set.set(File.binary(path, content))
         
         outputs = [self.file_set.file(file) for file in
             (watch.outputs_internal.union(watch.outputs_external))]
         
-        self.actions[key] = Action(watch.inputs, outputs, output)
+        action = Action(watch.inputs, outputs, output)
+        self.actions.add(key, action, cost, full_key)
+        
+        if self.shared != None:
+            self.shared.store_action(key, action, cost)
         
+        return self.keep_spills(output)
+    
+    def keep_spills(self, output):
+        if len(self.old_spills) > len(self.kept_spills):
+            text = pickle.dumps(output, pickle.HIGHEST_PROTOCOL)
+            self.kept_spills.update(
+                name for name in self.old_spills if name in text)
         return output
     
+    def remove_spills(self):
+        for name in self.old_spills - self.kept_spills:
+            try:
+                os.remove(os.path.join(self.context.spill_dir, name))
+            except OSError:
+                pass
+    
     def add_watch(self):
         watch = Watch(self.file_set.files)
         self.watches.append(watch)
@@ -80,6 +148,14 @@ class FileSetManager(object):
         for watch in self.watches:
             watch.add_output_external(name)
     
+    def watch_absent(self, name):
+        for watch in self.watches:
+            watch.add_absent(name)
+    
+    def watch_cost(self, seconds):
+        for watch in self.watches:
+            watch.extra_cost += seconds
+    
     def write_all(self):
         self.file_set.write_all(self.context.wd)
         
@@ -100,7 +176,7 @@ class FileSetManager(object):
     
     def restart(self, source):
         self.watch_output_internal(source)
-        self.file_set.files[source] = File.empty(source)
+        self.file_set.set(File.empty(source))
     
     def feed(self, source, block, redo, after, into):
         self.watch_input(source)
@@ -108,45 +184,213 @@ class FileSetManager(object):
         
         file = self.file_set.file(source)
         
-        self.file_set.files[source] = file.feed(block, redo, after, into)
+        self.file_set.set(file.feed(block, redo, after, into))
         
-    def run_interactive(self, imports, lines, language):
+    def run_interactive(self, imports, lines, language, limits):
         return self.do_watched(
-            lambda: language.run_interactive(lines, imports, self.context.wd)
+            lambda wd: language.run_interactive(lines, imports, wd),
+            language,
+            ('interactive', tuple(imports), tuple(lines)),
+            [''] * len(lines),
+            limits
         )
     
     def recall(self, source_name, block_name):
         self.watch_input(source_name)
         return self.file_set.file(source_name).recall(block_name)
     
-    def run(self, name, language):
+    def run(self, name, language, limits):
         return self.do_watched(
-            lambda: language.run(name, self.context.wd)
+            lambda wd: language.run(name, wd),
+            language,
+            ('run', name),
+            '',
+            limits
         )
     
-    def compile(self, name, language):
+    def compile(self, name, language, limits):
         return self.do_watched(
-            lambda: language.test_compile(name, self.context.wd)
+            lambda wd: language.test_compile(name, wd),
+            language,
+            ('compile', name),
+            '',
+            limits
         )
     
-    def do_watched(self, proc):
-        self.write_all()
+    def do_watched(self, proc, language, key, placeholder, limits):
+        '''
+        Run proc(wd), recording what it reads and writes. wd is a sandbox
+        holding just the files being built; what proc writes there is copied
+        back to the weaver dir. Processes proc starts are held to limits
+        (see supervise).
+        
+        While planning, proc is only queued as a Job (if the language can
+        run in parallel) and placeholder is returned. Afterwards, a prepared
+        result for the same key is used instead of running proc, as long as
+        the files it read are still the same.
+        '''
+        key = (language.__class__.__name__,) + key + (limits,)
+        
+        def limited_proc(wd, proc=proc):
+            with limited(limits):
+                return proc(wd)
+        proc = limited_proc
+        
+        if self.planning:
+            if language.parallel:
+                self.jobs.append(Job(key, self.file_set.files, proc,
+                    language.tracker))
+            return placeholder
         
+        self.write_all()
         wd = self.context.wd
-        output, mods = run_watch_files(proc, wd)
         
-        inputs = mods.accessed
-        outputs = mods.modified.union(mods.created)
+        result = self.take_prepared(key)
+        if result != None:
+            for path, content in result.outputs.items():
+                if content != None:
+                    makepdir(os.path.dirname(wd + '/' + path))
+                    with open(wd + '/' + path, 'wb') as hl:
+                        hl.write(content)
+            self.record_run(result.inputs, result.outputs, result.absent)
+            self.watch_cost(result.elapsed)
+            return result.output
+        
+        sandbox = self.sandboxes.take()
+        try:
+            sandbox.fill(self.file_set.files, wd)
+            output, inputs, outputs, absent = tracked_run(
+                language.tracker, proc, sandbox.path)
+            sandbox.merge(outputs, wd)
+        finally:
+            self.sandboxes.give(sandbox)
         
-        inputs  = [os.path.relpath(path, wd) for path in inputs]
-        outputs = [os.path.relpath(path, wd) for path in outputs]
+        self.record_run(inputs, outputs, absent)
         
+        return output
+    
+    def record_run(self, inputs, outputs, absent):
         for file in inputs:
             self.watch_input(file)
         for file in outputs:
             self.watch_output_external(file)
+            self.file_set.touch(file)
+        for file in absent:
+            self.watch_absent(file)
+    
+    def take_prepared(self, key):
+        results = self.prepared.get(key)
+        if not results:
+            return None
         
-        return output
+        result = results.pop(0)
+        if result.files_read == None:
+            return None
+        if not self.file_set.all_up_to_date(result.files_read):
+            return None
+        if result.names != None and not set(self.file_set.files) <= result.names:
+            # Without probes we can't tell whether the run would have looked
+            # for a file that has appeared since, so assume it would.
+            return None
+        return result
+    
+    def begin_plan(self):
+        '''
+        Start collecting runs instead of doing them (see do_watched). The
+        document should then be processed once, and end_plan() called.
+        '''
+        self.planning = True
+        self.jobs = [ ]
+    
+    def end_plan(self, processes):
+        '''
+        Do the collected runs, up to processes at a time, each in its own
+        directory built from the files as they were when it was queued.
+        Then start over with an empty file set, ready for the real pass.
+        
+        A run is independent of the others unless it reads something another
+        run writes. That can only be known afterwards, so when the real pass
+        reaches each run it checks that every file the run read (or looked
+        for and didn't find) is still the same, and otherwise does it again
+        there and then, in order.
+        '''
+        self.planning = False
+        
+        pool = ThreadPool(processes)
+        try:
+            results = pool.map(lambda job: job.run(), self.jobs)
+        finally:
+            pool.close()
+        
+        self.prepared = { }
+        for job, result in zip(self.jobs, results):
+            self.prepared.setdefault(job.key, []).append(result)
+        
+        self.jobs = [ ]
+        self.file_set = FileSet()
+
+JobResult = namedtuple('JobResult',
+    ['output', 'inputs', 'outputs', 'absent', 'files_read', 'names', 'elapsed'])
+
+class Job(object):
+    '''
+    A run queued while planning, with a snapshot of the files it was given.
+    '''
+    
+    def __init__(self, key, files, proc, tracker):
+        self.key     = key
+        self.files   = dict(files)
+        self.proc    = proc
+        self.tracker = tracker
+    
+    def run(self):
+        '''
+        Returns:
+            JobResult. outputs maps each path written to its new content (or
+            None if it was removed), and files_read is what the real pass
+            must find unchanged to use the result, as for an Action. If
+            missing files couldn't be traced, names is the set of files the
+            run had, and the result is only used if no others have appeared.
+        '''
+        wd = mkdtemp(prefix='rstweaver-job-')
+        try:
+            file_set = FileSet()
+            for file in self.files.values():
+                file_set.set(file)
+            file_set.write_all(wd)
+            
+            start = time.time()
+            output, inputs, outputs, absent = tracked_run(
+                self.tracker, self.proc, wd)
+            elapsed = time.time() - start
+            
+            watch = Watch(self.files)
+            for file in inputs:
+                watch.add_input(file)
+            for file in absent:
+                watch.add_absent(file)
+            
+            contents = { }
+            for path in outputs:
+                try:
+                    with open(wd + '/' + path, 'rb') as hl:
+                        contents[path] = hl.read()
+                except IOError:
+                    contents[path] = None
+            
+            if sees_absent(self.tracker):
+                names = None
+            else:
+                names = set(self.files)
+            
+            return JobResult(output, inputs, contents, absent,
+                tuple(watch.inputs), names, elapsed)
+        except Exception:
+            traceback.print_exc()
+            return JobResult(None, [], { }, set(), None, None, 0.0)
+        finally:
+            sessions.pool.close_in(wd)
+            shutil.rmtree(wd, True)
 
 class Watch(object):
     
@@ -156,13 +400,14 @@ class Watch(object):
         self.inputs = set()
         self.outputs_internal = set()
         self.outputs_external = set()
+        self.extra_cost = 0.0
     
     def add_input(self, name):
         if name in self.start_files:
             file = self.start_files[name]
         else:
             file = File.empty(name)
-        self.inputs.add(file)
+        self.inputs.add((name, file.digest()))
     
     def add_output_internal(self, name):
         self.outputs_internal.add(name)
@@ -170,42 +415,90 @@ class Watch(object):
     def add_output_external(self, name):
         self.outputs_external.add(name)
     
+    def add_absent(self, name):
+        '''
+        The run looked for name and it wasn't there. Recorded as an input
+        with no digest, meaning "must not exist".
+        '''
+        if name not in self.start_files:
+            self.inputs.add((name, None))
+
 class FileSet(object):
+    '''
+    The files being built, by name.
+    
+    Changes should go through set() so that write_all() knows which files
+    need looking at; the rest are known to match what is on disk.
+    '''
     
     def __init__(self):
         self.files   = { }
+        self.dirty   = set()
     
     def file(self, name):
         if name not in self.files:
-            self.files[name] = File.empty(name)
+            self.set(File.empty(name))
             
         return self.files[name]
     
+    def set(self, file):
+        self.files[file.name] = file
+        self.dirty.add(file.name)
+    
+    def touch(self, name):
+        '''
+        The copy of name on disk may have been changed behind our back.
+        '''
+        if name in self.files:
+            self.dirty.add(name)
+    
     def write_all(self, wd):
-        for name, file in self.files.items():
-            file.write(wd)
+        for name in self.dirty:
+            self.files[name].write(wd)
+        self.dirty = set()
     
     def all_up_to_date(self, inputs):
-        for input in inputs:
-            if self.file(input.name) != input:
+        # Only looks: asking self.file() would add every name checked, and
+        # write_all() would then make them all exist.
+        for name, digest in inputs:
+            file = self.files.get(name)
+            if digest == None:
+                if file != None:
+                    return False
+            elif file == None:
+                if File.empty(name).digest() != digest:
+                    return False
+            elif file.digest() != digest:
                 return False
         return True
     
     def apply_outputs(self, outputs):
         for output in outputs:
-            self.files[output.name] = output
+            self.set(output)
     
-_File = namedtuple('File', ['name', 'block'])
+_File = namedtuple('File', ['name', 'block', 'names'])
 
 class File(_File):
+    '''
+    A file being built up out of blocks.
+    
+    names maps each block name to the paths (tuples of Rope keys, from the
+    top block down) of the blocks with that name. It is a rope.Map, so feed()
+    makes a new one in O(log n) instead of copying it, and finding a named
+    block is a lookup instead of a search of the whole file.
+    
+    Paths compare in document order (a block before the blocks inside it),
+    which is what picks between blocks with the same name; see find() and
+    find_after().
+    '''
     
     @staticmethod
     def binary(name, content):
-        return File(name, Block.binary(content))
+        return File(name, Block.binary(content), rope.empty_map)
     
     @staticmethod
     def empty(name):
-        return File(name, Block.empty())
+        return File(name, Block.empty(), rope.empty_map)
     
     def is_empty(self):
         return self.block.is_empty()
@@ -213,38 +506,97 @@ class File(_File):
     def count_lines(self):
         return self.block.count_lines()
     
+    def digest(self):
+        return self.block.digest()
+    
+    def text_length(self):
+        return self.block.text_length()
+    
+    def find(self, name):
+        '''
+        Path to the block called name, for redo, into and recall: the last
+        one in the file if there are several, a block inside another of the
+        same name counting as after it.
+        '''
+        return max(self.paths(name))
+    
+    def find_after(self, name):
+        '''
+        Path to the block called name, for after. Blocks are taken by their
+        parents, the parent coming last in the file first, and then the
+        last of that parent's blocks.
+        '''
+        return max(self.paths(name), key=lambda path: (path[:-1], path[-1]))
+    
+    def paths(self, name):
+        paths = self.names.get(name)
+        if not paths:
+            raise NameNotFound(name)
+        return paths
+    
     def feed(self, block, redo, after, into):
-        old_block = self.block
+        top = self.block
+        old = None
         if into != None:
-            new_block = old_block.into(block, into)
-            if new_block == None: raise NameNotFound(into)
+            parent = self.find(into)
+            key = top.at(parent).subblocks.append_key()
+        elif after == 'start':
+            parent = ()
+            key = top.subblocks.prepend_key()
         elif after != None:
-            new_block = old_block.after(block, after)
-            if new_block == None:
-                raise NameNotFound(after)
+            path = self.find_after(after)
+            parent = path[:-1]
+            key = top.at(parent).subblocks.insert_key(path[-1])
         elif redo:
-            new_block = old_block.redo(block, block.name)
-            if new_block == None: raise NameNotFound(block.name)
+            path = self.find(block.name)
+            parent = path[:-1]
+            key = path[-1]
+            old = top.at(path)
         else:
-            new_block = old_block.append(block)
+            parent = ()
+            key = top.subblocks.append_key()
+        
+        path = parent + (key,)
+        names = self.names
         
-        return self._replace(block = new_block)
+        if old != None:
+            for name, old_path in old.named_paths(path):
+                paths = tuple(p for p in names.get(name) if p != old_path)
+                if paths: names = names.set(name, paths)
+                else: names = names.remove(name)
+        
+        for name, new_path in block.named_paths(path):
+            names = names.set(name, names.get(name, ()) + (new_path,))
+        
+        return File(self.name, top.put(path, block), names)
     
     def recall(self, name):
-        res = self.block.recall(name)
-        if res == None:
-            raise NameNotFound(name)
-        return res
+        return self.block.at(self.find(name)).text()
     
     def restart(self):
-        return File(self.name, Block.empty(None))
+        return File.empty(self.name)
     
     def text(self):
         return self.block.text()
     
     def write(self, wd):
-        with open(wd + '/' + self.name, 'w') as hl:
-            hl.write(self.text())
+        '''
+        Write the file under wd, unless it is already there as it should be.
+        Leaving it alone keeps its mtime, so compilers don't rebuild it.
+        '''
+        path = wd + '/' + self.name
+        text = self.text()
+        
+        try:
+            if os.path.getsize(path) == len(text):
+                with open(path, 'rb') as hl:
+                    if hl.read() == text:
+                        return
+        except (OSError, IOError):
+            pass
+        
+        with open(path, 'wb') as hl:
+            hl.write(text)
     
     def __str__(self):
         return '(%s: %s)' % (self.name, self.text())
@@ -254,27 +606,69 @@ class File(_File):
     
 _Block = namedtuple('Block', ['name', 'lines', 'subblocks', 'blob'])
 
+# A line that is just <<<name>>> leaves a place for the block called name;
+# <<<<name>>>> elsewhere is a literal <<<name>>>.
+placeholder_line = re.compile(r'^\s*\<\<\<([^\>]*)\>\>\>\s*$')
+escaped_placeholder = re.compile(r'\<\<\<\<([^\>]*)\>\>\>\>')
+
 class Block(_Block):
+    '''
+    A named chunk of a file: some lines of its own followed by subblocks, or
+    else a binary blob.
+    
+    subblocks is a Rope, so adding or replacing one costs O(log n), and line
+    counts, text length and digests come from the Rope without walking it.
+    '''
     
     @staticmethod
     def empty(name = None):
-        return Block(name, (), (), None)
+        return Block(name, (), rope.empty, None)
     
     @staticmethod
     def binary(content):
-        return Block(None, (), (), content)
+        return Block(None, (), rope.empty, content)
     
     @staticmethod
     def just_text(text):
-        return Block(None, tuple(text.split('\n')), (), None)
+        return Block(None, tuple(text.split('\n')), rope.empty, None)
     
     @staticmethod
     def with_lines(name, lines):
-        return Block(name, lines, (), None)
+        return Block(name, lines, rope.empty, None)
     
     @staticmethod
     def with_parts(name, parts):
-        return Block(name, (), parts, None)
+        return Block(name, (), Rope.of(parts), None)
+    
+    @staticmethod
+    def parse(name, lines):
+        '''
+        A block from the lines of a directive: runs of lines, with an empty
+        named block wherever a line is just <<<name>>>.
+        
+        One pass, and lines without <<< in them aren't matched against
+        anything, so a block of any length costs about as much as reading it.
+        '''
+        parts   = [ ]
+        leading = [ ]
+        
+        for line in lines:
+            if '<<<' in line:
+                match = placeholder_line.match(line)
+                if match != None:
+                    parts.append(Block.with_lines(None, tuple(leading)))
+                    parts.append(Block.empty(match.group(1)))
+                    leading = [ ]
+                    continue
+                
+                line = escaped_placeholder.sub(r'<<<\1>>>', line)
+            
+            leading.append(line)
+        
+        if len(leading) > 0:
+            parts.append(Block.with_lines(None, tuple(leading)))
+        
+        return Block.with_parts(name, parts)
     
     def is_empty(self):
         if len(self.lines) > 0: return False
@@ -283,13 +677,48 @@ class Block(_Block):
         return True
     
     def count_lines(self):
-        return len(self.lines) + sum(
-            block.count_lines() for block in self.subblocks
-        )
+        return len(self.lines) + self.subblocks.count_lines()
+    
+    def lines_length(self):
+        '''
+        Total length of all lines (ours and subblocks'), counting a newline
+        after each.
+        '''
+        if '_length' not in self.__dict__:
+            self.__dict__['_length'] = sum(len(line) + 1 for line in self.lines)
+        return self.__dict__['_length'] + self.subblocks.lines_length()
+    
+    def text_length(self):
+        '''
+        len(self.text()), without building the text.
+        '''
+        if self.blob != None:
+            return len(self.blob)
+        return max(self.lines_length(), 1)
+    
+    def digest(self):
+        '''
+        Merkle-style digest of this block: its own name, lines and blob, plus
+        the digest of its subblocks. Blocks are never modified, so it is
+        computed once, and a new parent only hashes its children's digests.
+        '''
+        if '_digest' not in self.__dict__:
+            self.__dict__['_digest'] = fingerprint((
+                self.name,
+                self.lines,
+                self.subblocks.digest(),
+                self.blob
+            ))
+        return self.__dict__['_digest']
     
     def all_lines(self):
-        return self.lines + reduce(operator.add,
-            (sblock.all_lines() for sblock in self.subblocks), ())
+        lines = [ ]
+        stack = [self]
+        while stack:
+            block = stack.pop()
+            lines.extend(block.lines)
+            stack.extend(reversed(block.subblocks))
+        return lines
     
     def text(self):
         if self.blob != None:
@@ -297,77 +726,40 @@ class Block(_Block):
         else:
             return '\n'.join(self.all_lines()) + '\n'
     
-    def reverse_searched(handler):
-        def decorated(self, *a, **b):
-            look_first = reversed(self.subblocks)
-            for block in look_first:
-                res = decorated(block, *a, **b)
-                if res != None: return res
-            
-            res = handler(self, *a, **b)
-            if res != None:
-                return res
-            
-            return None
-        
-        return decorated
-    
-    def reverse_replaced(handler):
-        def decorated(self, *a, **b):
-            sblocks = list(reversed(self.subblocks))
-            for i in range(len(sblocks)):
-                sblock = sblocks[i]
-                res = decorated(sblock, *a, **b)
-                
-                if res != None:
-                    sblocks[i] = res
-                    return self._replace(subblocks=tuple(reversed(sblocks)))
-            else:
-                return handler(self, *a, **b)
-        
-        return decorated
+    def at(self, path):
+        '''
+        The block under path (a tuple of Rope keys) from here.
+        '''
+        block = self
+        for key in path:
+            block = block.subblocks.get(key)
+        return block
+    
+    def put(self, path, block):
+        '''
+        This block with block put under path (which must not be empty).
+        '''
+        key = path[0]
+        if len(path) > 1:
+            block = self.subblocks.get(key).put(path[1:], block)
+        return self._replace(subblocks = self.subblocks.replace(key, block))
+    
+    def named_paths(self, path):
+        '''
+        (name, path) for this block, which is at path, and every named block
+        inside it.
+        '''
+        stack = [(path, self)]
+        while stack:
+            path, block = stack.pop()
+            if block.name != None:
+                yield (block.name, path)
+            for key, sblock in block.subblocks.items():
+                stack.append((path + (key,), sblock))
     
     def append(self, block):
-        sblocks = self.subblocks
-        sblocks = sblocks + (block,)
+        sblocks = self.subblocks.append(block)
         return self._replace(subblocks = sblocks)
-    
-    @reverse_replaced
-    def redo(self, block, name):
-        if self.name == name:
-            return block
-        return None
-    
-    @reverse_replaced
-    def after(self, block, after):
-        if after == 'start':
-            sblocks = self.subblocks
-            sblocks = (block,) + sblocks
-            return self._replace(subblocks = sblocks)
-        else:
-            sblocks = list(reversed(self.subblocks))
-            for i in range(len(sblocks)):
-                sblock = sblocks[i]
-                if sblock.name == after:
-                    sblocks.insert(i, block)
-                    sblocks = tuple(reversed(sblocks))
-                    return self._replace(subblocks=sblocks)
-            else:
-                return None
-    
-    @reverse_replaced
-    def into(self, block, into):
-        if self.name == into:
-            sblocks = self.subblocks
-            sblocks = sblocks + (block,)
-            return self._replace(subblocks = sblocks)
-        return None
-    
-    @reverse_searched
-    def recall(self, name):
-        if self.name == name:
-            return self.text()
-        return None
 
 class NameNotFound(Exception):
     
@@ -0,0 +1,124 @@
+
+'''
+Keeping runs from going on forever or taking the machine with them.
+
+Processes started through WeaverLanguage.popen() get a process group of
+their own and any CPU and memory limits in force; WeaverLanguage.communicate()
+kills the whole group once the run has gone on for longer than its timeout.
+The limits in force are set per thread by limited(), around each run, and
+the timeout counts from there: each process gets only what the run has left
+(see watchdog()), however many the run starts.
+
+A run that was killed returns what it had printed with a note on the end,
+and is cached like any other.
+'''
+
+import os
+import time
+import signal
+import resource
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+# timeout is wall-clock seconds for the whole run, cpu CPU seconds for each
+# process, memory bytes of address space; None for no limit.
+Limits = namedtuple('Limits', ['timeout', 'cpu', 'memory'])
+
+default_limits = Limits(120, None, None)
+
+no_limits = Limits(None, None, None)
+
+state = threading.local()
+
+@contextmanager
+def limited(limits):
+    '''
+    Apply limits to processes started on this thread, until the end of
+    the with block.
+    '''
+    old = (current(), getattr(state, 'deadline', None))
+    state.limits = limits
+    state.deadline = (None if limits.timeout == None
+        else time.time() + limits.timeout)
+    try:
+        yield
+    finally:
+        state.limits, state.deadline = old
+
+def current():
+    return getattr(state, 'limits', no_limits)
+
+def remaining():
+    '''
+    Seconds left before the current run's timeout, or None for no limit.
+    '''
+    deadline = getattr(state, 'deadline', None)
+    if deadline == None:
+        return None
+    return max(0, deadline - time.time())
+
+def watchdog(proc):
+    '''
+    A Watchdog for proc that fires when the current run's time is up.
+    '''
+    return Watchdog(proc, remaining(), current().timeout)
+
+def preexec(limits):
+    '''
+    Function for Popen's preexec_fn that puts the child in a new process
+    group and applies limits.
+    '''
+    def setup():
+        os.setsid()
+        if limits.cpu != None:
+            cpu = int(limits.cpu)
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu))
+        if limits.memory != None:
+            memory = int(limits.memory)
+            resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+    return setup
+
+def kill_group(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+class Watchdog(object):
+    '''
+    Kill proc's process group if the with block lasts longer than timeout
+    seconds (None for never). fired says whether it did. limit is the
+    timeout to name in the note, if it isn't timeout itself (the run's,
+    when this is what it has left).
+    '''
+    
+    def __init__(self, proc, timeout, limit=None):
+        self.proc    = proc
+        self.timeout = timeout
+        self.limit   = timeout if limit == None else limit
+        self.fired   = False
+        self.timer   = None
+    
+    def __enter__(self):
+        if self.timeout != None:
+            self.timer = threading.Timer(self.timeout, self.fire)
+            self.timer.daemon = True
+            self.timer.start()
+        return self
+    
+    def __exit__(self, *exc):
+        if self.timer != None:
+            # Joined, so that no timer is left for interpreter shutdown to
+            # trip over.
+            self.timer.cancel()
+            self.timer.join()
+        return False
+    
+    def fire(self):
+        self.fired = True
+        kill_group(self.proc)
+    
+    def note(self):
+        return '\n[... killed after %g seconds ...]\n' % self.limit
+
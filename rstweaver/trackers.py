@@ -0,0 +1,83 @@
+
+'''
+Finding out which files a run read and wrote.
+
+A language picks its tracker by name with WeaverLanguage.tracker:
+    
+    inotify -- Watch the working directory (through treewatcher). Sees
+        everything done there, by whatever process or by rstweaver itself,
+        but has to set up watches over the whole directory for every run,
+        and can't see files looked for and not found.
+    strace  -- Trace the processes the run starts through
+        WeaverLanguage.popen(), and nothing else (see probes). There is
+        nothing to set up, but a language whose runs read or write files
+        any other way (in Python, or through the interpreters kept by
+        sessions) must not use it. Where strace can't be used, inotify is
+        used instead.
+
+Nothing is run under strace for languages that use inotify: tracing stops
+every process on every file call, which is too much to pay for on every run.
+'''
+
+import os
+import probes
+from treewatcher import run_watch_files
+
+class InotifyTracker(object):
+    
+    def run(self, proc, wd):
+        '''
+        Run proc(wd), and see what it did.
+        
+        Returns:
+            (output, paths read, paths written, paths looked for but absent),
+            paths relative to wd.
+        '''
+        output, mods = run_watch_files(lambda: proc(wd), wd)
+        
+        inputs = mods.accessed
+        outputs = mods.modified.union(mods.created)
+        
+        inputs  = [os.path.relpath(path, wd) for path in inputs]
+        outputs = [os.path.relpath(path, wd) for path in outputs]
+        
+        return (output, inputs, outputs, set())
+    
+    def sees_absent(self):
+        return False
+
+class StraceTracker(object):
+    
+    def run(self, proc, wd):
+        if not probes.strace_usable():
+            return trackers['inotify'].run(proc, wd)
+        
+        probes.begin(wd)
+        try:
+            output = proc(wd)
+        finally:
+            trace = probes.end()
+        
+        return (output, sorted(trace.read), sorted(trace.written), trace.absent)
+    
+    def sees_absent(self):
+        return probes.strace_usable()
+
+trackers = {
+    'inotify': InotifyTracker(),
+    'strace':  StraceTracker()
+}
+
+def tracked_run(tracker, proc, wd):
+    '''
+    Run proc(wd) under the tracker called tracker; see InotifyTracker.run.
+    '''
+    return trackers[tracker].run(proc, wd)
+
+def sees_absent(tracker):
+    '''
+    Whether runs under the tracker called tracker report the files they
+    looked for and didn't find.
+    '''
+    return trackers[tracker].sees_absent()
+
@@ -1,6 +1,10 @@
 
 import os
 import errno
+import fcntl
+import shutil
+import hashlib
+from contextlib import contextmanager
 
 def makepdir(path):
     try:
@@ -11,4 +15,131 @@ def makepdir(path):
         else:
             raise
 
+def user_cache_dir(*parts):
+    '''
+    A directory for things kept from one build (and document) to the next:
+    $RSTWEAVER_CACHE, or ~/.cache/rstweaver, joined with parts. Made if it
+    doesn't exist.
+    '''
+    root = os.environ.get('RSTWEAVER_CACHE')
+    if root == None:
+        root = os.path.join(os.path.expanduser('~'), '.cache', 'rstweaver')
+    
+    path = os.path.join(root, *parts)
+    makepdir(path)
+    return path
+
+def user_cache_budget():
+    '''
+    Bytes the user cache dir may take up: $RSTWEAVER_CACHE_SIZE megabytes,
+    or a gigabyte.
+    '''
+    return int(float(os.environ.get('RSTWEAVER_CACHE_SIZE', 1024)) * 1024 * 1024)
+
+def used(path):
+    '''
+    Mark a cache entry as just used, for trim_cache.
+    '''
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+def trim_cache(roots, budget):
+    '''
+    Delete the least recently used (see used()) of the entries filed under
+    roots, as root/xx/name, files or directories, until they take up no more
+    than budget bytes together. Lock files and temporary (dot) files are
+    left alone.
+    '''
+    entries = [ ]
+    for root in roots:
+        for bucket in listdir(root):
+            for name in listdir(os.path.join(root, bucket)):
+                if name.startswith('.') or name.endswith('.lock'):
+                    continue
+                path = os.path.join(root, bucket, name)
+                try:
+                    mtime = os.lstat(path).st_mtime
+                except OSError:
+                    continue
+                entries.append((mtime, path, tree_size(path)))
+    
+    total = sum(size for mtime, path, size in entries)
+    for mtime, path, size in sorted(entries):
+        if total <= budget:
+            break
+        if os.path.isdir(path):
+            shutil.rmtree(path, True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total -= size
+
+def listdir(path):
+    try:
+        return os.listdir(path)
+    except OSError:
+        return [ ]
+
+def tree_size(path):
+    if not os.path.isdir(path):
+        try:
+            return os.lstat(path).st_size
+        except OSError:
+            return 0
+    
+    total = 0
+    for dir, subdirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(dir, name)).st_size
+            except OSError:
+                pass
+    return total
+
+@contextmanager
+def locked(path):
+    '''
+    Hold an exclusive lock on the file at path (made if need be), against
+    other threads and processes doing the same.
+    '''
+    with open(path, 'a') as hl:
+        fcntl.flock(hl.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(hl.fileno(), fcntl.LOCK_UN)
+
+def fingerprint(obj):
+    '''
+    Hex digest of a structure of tuples, lists, strings, numbers and None.
+    
+    The encoding is canonical, so equal structures give equal digests from
+    one build (or machine) to the next.
+    '''
+    h = hashlib.sha1()
+    feed_hash(h, obj)
+    return h.hexdigest()
+
+def feed_hash(h, obj):
+    if obj is None:
+        h.update('N')
+    elif isinstance(obj, unicode):
+        data = obj.encode('utf-8')
+        h.update('U%d:' % len(data))
+        h.update(data)
+    elif isinstance(obj, str):
+        h.update('S%d:' % len(obj))
+        h.update(obj)
+    elif isinstance(obj, (tuple, list)):
+        h.update('T%d:' % len(obj))
+        for item in obj:
+            feed_hash(h, item)
+    elif isinstance(obj, (bool, int, long, float)):
+        h.update('I%r;' % obj)
+    else:
+        raise TypeError('Cannot fingerprint %r' % (obj,))
 
@@ -0,0 +1,55 @@
+
+import os
+import shutil
+import sqlite3
+import unittest
+from tempfile import mkdtemp
+
+from rstweaver.structure import FileSetManager
+
+class Context(object):
+    
+    def __init__(self, root_dir, shared_cache):
+        self.wd = root_dir
+        self.root_dir = root_dir
+        self.spill_dir = root_dir + '/output'
+        self.cache_budget = 1024 * 1024
+        self.debug_keys = False
+        self.shared_cache = shared_cache
+        self.shared_cache_budget = None
+
+class SharedHitTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.shared = os.path.join(self.dir, 'shared')
+    
+    def tearDown(self):
+        shutil.rmtree(self.dir, True)
+    
+    def manager(self, name):
+        return FileSetManager(Context(os.path.join(self.dir, name), self.shared))
+    
+    def full_keys(self, name):
+        conn = sqlite3.connect(os.path.join(self.dir, name, 'cache.sqlite'))
+        try:
+            return [row[0] for row in conn.execute('SELECT full_key FROM actions')]
+        finally:
+            conn.close()
+    
+    def test_shared_hit_keeps_no_full_key(self):
+        full_key = ('python', (), (), ('print 1',))
+        
+        first = self.manager('first')
+        self.assertEqual(first.run_cache('k', lambda: 'made', full_key), 'made')
+        
+        second = self.manager('second')
+        def producer():
+            raise AssertionError('should have come from the shared cache')
+        self.assertEqual(second.run_cache('k', producer, full_key), 'made')
+        
+        self.assertEqual(self.full_keys('first'), [None])
+        self.assertEqual(self.full_keys('second'), [None])
+
+if __name__ == '__main__':
+    unittest.main()